@@ -4,6 +4,9 @@ import os
 import sys
 import logging
 import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # 設置 UTF-8 編碼
@@ -17,6 +20,15 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from pdf_processor import PDFProcessor
 from vlm_client import QwenVLMClient
+from vlm_cache import VLMResultCache
+from vlm_scheduler import VLMRequestScheduler
+from image_preprocess import ImagePreprocessor
+from image_filter import ImageFilter
+from checkpoint_journal import CheckpointJournal
+from mode_planner import ModePlanner
+from text_layer import TextLayerAnalyzer, SOURCE_NATIVE, SOURCE_HYBRID
+from page_tiler import PageTiler
+from sidecar_writer import SidecarWriter
 
 # 設置日誌
 logging.basicConfig(
@@ -85,7 +97,7 @@ def wait_for_vllm_ready(vlm_client: QwenVLMClient, max_retries: int = 30):
     for i in range(max_retries):
         try:
             # 嘗試發送一個簡單的測試請求
-            test_result = vlm_client.analyze_image(test_image_base64, "description")
+            test_result = vlm_client.analyze_image(test_image_base64, "description", use_cache=False)
             if test_result.get("success", False) or ("error" in test_result and "Connection" not in str(test_result.get("error", ""))):
                 logger.info("vLLM 服務已準備就緒")
                 return True
@@ -96,57 +108,34 @@ def wait_for_vllm_ready(vlm_client: QwenVLMClient, max_retries: int = 30):
     logger.error("vLLM 服務啟動超時")
     return False
 
-def save_images_to_folder(input_pdf_path: str, images_info: list) -> str:
-    """將圖片保存到資料夾"""
-    # 創建圖片保存目錄
+def get_images_folder(input_pdf_path: str) -> Path:
+    """返回並建立保存 PDF 圖片的資料夾"""
     pdf_name = Path(input_pdf_path).stem
     images_dir = Path("./extracted_images") / pdf_name
     images_dir.mkdir(parents=True, exist_ok=True)
-    
-    saved_images = []
-    
-    try:
-        logger.info(f"開始保存 {len(images_info)} 張圖片到 {images_dir}")
-        
-        for i, img_info in enumerate(images_info):
-            # 生成圖片文件名
-            page_num = img_info['page_num'] + 1
-            filename = f"page_{page_num:03d}_img_{i+1:03d}.png"
-            image_path = images_dir / filename
-            
-            # 保存圖片
-            img_info['image'].save(image_path, 'PNG')
-            saved_images.append(str(image_path))
-            
-            if (i + 1) % 50 == 0:  # 每50張圖片顯示一次進度
-                logger.info(f"已保存 {i+1}/{len(images_info)} 張圖片")
-        
-        logger.info(f"✅ 所有圖片已保存到: {images_dir}")
-        return str(images_dir)
-        
-    except Exception as e:
-        logger.error(f"保存圖片時發生錯誤: {str(e)}")
-        return ""
+    return images_dir
 
-def print_pdf_images_info(input_pdf_path: str):
-    """打印 PDF 中的圖片信息"""
+def print_pdf_images_info(input_pdf_path: str, save_images: bool = False) -> int:
+    """打印 PDF 中的圖片信息，可同時將圖片保存到資料夾，返回圖片數量
+    
+    圖片逐張串流處理，不會一次把整份文件的圖片載入記憶體
+    """
     pdf_processor = PDFProcessor()
+    images_count = 0
     
     try:
         logger.info(f"分析 PDF 文件: {input_pdf_path}")
         
-        # 提取圖片信息
-        images_info = pdf_processor.extract_images_from_pdf(input_pdf_path)
+        images_dir = get_images_folder(input_pdf_path) if save_images else None
+        if images_dir is not None:
+            logger.info(f"開始保存圖片到 {images_dir}")
         
         print(f"\n=== PDF 圖片信息 ===")
-        print(f"文件: {input_pdf_path}")
-        print(f"總共找到 {len(images_info)} 張圖片\n")
+        print(f"文件: {input_pdf_path}\n")
         
-        if not images_info:
-            print("此 PDF 中沒有找到任何圖片")
-            return images_info
-        
-        for i, img_info in enumerate(images_info, 1):
+        # 逐張提取圖片信息
+        for i, img_info in enumerate(pdf_processor.iter_images_from_pdf(input_pdf_path), 1):
+            images_count = i
             print(f"圖片 {i}:")
             print(f"  頁面: {img_info['page_num'] + 1}")
             print(f"  位置: x={img_info['rect'].x0:.1f}, y={img_info['rect'].y0:.1f}")
@@ -154,66 +143,168 @@ def print_pdf_images_info(input_pdf_path: str):
             print(f"  圖片尺寸: {img_info['image'].size[0]}x{img_info['image'].size[1]} 像素")
             print(f"  圖片模式: {img_info['image'].mode}")
             print()
+            
+            if images_dir is not None:
+                # 生成圖片文件名並保存
+                page_num = img_info['page_num'] + 1
+                filename = f"page_{page_num:03d}_img_{i:03d}.png"
+                img_info['image'].save(images_dir / filename, 'PNG')
+                
+                if i % 50 == 0:  # 每50張圖片顯示一次進度
+                    logger.info(f"已保存 {i} 張圖片")
         
+        if images_count == 0:
+            print("此 PDF 中沒有找到任何圖片")
+            return 0
+        
+        print(f"總共找到 {images_count} 張圖片")
         print(f"=== 分析完成 ===\n")
-        return images_info
+        if images_dir is not None:
+            logger.info(f"✅ 所有圖片已保存到: {images_dir}")
+        return images_count
         
     except Exception as e:
         logger.error(f"分析 PDF 圖片時發生錯誤: {str(e)}")
-        return []
+        return images_count
 
-def process_pdf_with_vlm(input_pdf_path: str, output_pdf_path: str, use_page_mode: bool = False, test_mode: bool = False):
-    """處理 PDF 文件，提取圖片並使用 VLM 分析"""
+def open_vlm_cache(cache_path: str = None, test_mode: bool = False):
+    """開啟 VLM 結果快取；未指定時讀取 VLM_CACHE_PATH，設為空字串或測試模式時返回 None"""
+    if cache_path is None:
+        cache_path = os.getenv("VLM_CACHE_PATH", "./temp/vlm_cache.sqlite")
+    return VLMResultCache(cache_path) if cache_path and not test_mode else None
+
+def process_pdf_with_vlm(input_pdf_path: str, output_pdf_path: str, use_page_mode: bool = False, test_mode: bool = False,
+                         scheduler: VLMRequestScheduler = None, dpi: int = 150, cache_path: str = None,
+                         mode: str = None, sidecar_formats: str = None, vlm_cache: VLMResultCache = None):
+    """
+    處理 PDF 文件，提取圖片並使用 VLM 分析
+    
+    mode 為 "image"、"page" 或 "auto"（逐頁選擇成本較低的方式），未指定時依 use_page_mode 決定；
+    多份文件同時處理時傳入同一個 scheduler，其最大併發數即為所有文件共用的 VLM 請求上限，
+    並傳入同一個 vlm_cache（此時忽略 cache_path），快取大小上限才會對所有文件一起生效；
+    sidecar_formats 為逗號分隔的結構化結果格式（jsonl、parquet），未指定時讀取 SIDECAR_FORMATS，空字串表示停用
+    """
+    if mode is None:
+        mode = "page" if use_page_mode else "image"
     
     # 初始化組件
     pdf_processor = PDFProcessor()
-    vlm_client = QwenVLMClient(os.getenv("VLLM_API_URL", "http://localhost:8000"))
+    
+    # 未提供共用快取時，為此文件開啟一個
+    owns_cache = vlm_cache is None
+    if owns_cache:
+        vlm_cache = open_vlm_cache(cache_path, test_mode)
+    vlm_client = QwenVLMClient(os.getenv("VLLM_API_URL", "http://localhost:8000"), cache=vlm_cache,
+                               pool_size=scheduler.max_in_flight if scheduler is not None else None)
     
     # 測試模式跳過 VLM 服務檢查
     if not test_mode:
         # 等待 vLLM 服務準備就緒
         if not wait_for_vllm_ready(vlm_client):
             logger.error("無法連接到 vLLM 服務")
+            vlm_client.close()
+            if vlm_cache is not None and owns_cache:
+                vlm_cache.close()
             return False
     
+    # 上傳前的圖片縮放與格式選擇
+    image_preprocessor = ImagePreprocessor()
+    
+    # 過小或空白圖片的預過濾；合併模式每張圖片一次請求，否則兩次
+    combined_mode = os.getenv("VLM_COMBINED_MODE", "true").lower() == "true"
+    image_filter = ImageFilter(calls_per_image=1 if combined_mode else 2)
+    
+    # 未提供共用排程器時，為此文件建立一個
+    owns_scheduler = scheduler is None
+    if owns_scheduler:
+        scheduler = VLMRequestScheduler()
+    
+    # 進度日誌：每完成一張圖片或一頁就追加記錄，重新執行時跳過已完成的部分
+    checkpoint_enabled = os.getenv("CHECKPOINT_ENABLED", "true").lower() == "true"
+    journal = None
+    if checkpoint_enabled and not test_mode:
+        journal = CheckpointJournal(input_pdf_path, mode)
+    completed = False
+    
+    # 結構化結果：每張圖片或每頁一筆，與輸出 PDF 同名，下游不需要再解析 PDF
+    if sidecar_formats is None:
+        sidecar_formats = os.getenv("SIDECAR_FORMATS", "jsonl")
+    sidecar = None
+    if sidecar_formats.strip():
+        sidecar = SidecarWriter(output_pdf_path, Path(input_pdf_path).name, sidecar_formats.split(","))
+    
     try:
         logger.info(f"開始處理 PDF: {input_pdf_path}")
         
-        if use_page_mode:
+        # 自動模式：逐頁估計兩種方式的成本，各頁只以較省的方式處理
+        image_pages = page_pages = None
+        if mode == "auto":
+            planner = ModePlanner(dpi=dpi, min_rect_area=image_filter.min_rect_area,
+                                  min_pixel_size=image_filter.min_pixel_size,
+                                  calls_per_image=image_filter.calls_per_image)
+            plans = planner.plan(input_pdf_path)
+            image_pages = [plan['page_num'] for plan in plans if plan['mode'] == "image"]
+            page_pages = [plan['page_num'] for plan in plans if plan['mode'] == "page"]
+            logger.info(f"自動模式規劃: {ModePlanner.summarize(plans)}")
+        
+        if mode in ("page", "auto"):
             # 頁面模式：將每頁轉換為圖片進行 OCR
             logger.info("使用頁面模式進行 OCR 處理...")
             
-            # 將頁面轉換為圖片
-            pages_info = pdf_processor.convert_pages_to_images(input_pdf_path)
-            logger.info(f"轉換了 {len(pages_info)} 頁")
+            # 頁面圖片在渲染時一併保存，SAVE_PAGE_IMAGES=false 時不寫入磁碟
+            save_page_images = os.getenv("SAVE_PAGE_IMAGES", "true").lower() == "true"
+            stream_mode = os.getenv("VLM_STREAM", "false").lower() == "true"
+            pages_save_dir = "./extracted_pages" if save_page_images else None
             
-            # 保存頁面圖片
-            pages_dir = pdf_processor.save_pages_as_images(input_pdf_path, "./extracted_pages")
+            # 原生文字層足夠的頁面直接使用 page.get_text，不送交 VLM；TEXT_LAYER_ENABLED=false 時整頁 OCR
+            text_layer_enabled = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+            text_layer = TextLayerAnalyzer(min_region_area=image_filter.min_rect_area) if text_layer_enabled else None
             
-            # 對每頁進行 OCR
-            pages_ocr_results = []
+            # 分塊 OCR：超過像素上限的頁面切成重疊區塊同時 OCR，適合搭配較高的 --dpi
+            page_tiling = os.getenv("PAGE_TILING", "false").lower() == "true"
+            page_tiler = PageTiler() if page_tiling else None
             
-            print(f"\n=== 頁面 OCR 結果 ===")
-            print(f"文件: {input_pdf_path}")
-            print(f"總共 {len(pages_info)} 頁\n")
+            def iter_ocr_units(pages):
+                """將需要分塊的頁面展開為多個區塊任務，讓區塊與其他頁面共用排程器的併發上限"""
+                for i, page_info in enumerate(pages):
+                    if page_tiler is None or page_info['image'] is None or (
+                            journal is not None and journal.get(f"page:{page_info['page_num']}") is not None):
+                        yield i, page_info
+                        continue
+                    
+                    tiles = page_tiler.split(page_info['image'])
+                    if len(tiles) == 1:
+                        yield i, page_info
+                        continue
+                    
+                    for tile in tiles:
+                        yield i, dict(page_info, image=tile['image'], tile=tile, tile_count=len(tiles))
             
-            for i, page_info in enumerate(pages_info):
-                logger.info(f"對第 {i+1}/{len(pages_info)} 頁進行 OCR...")
+            def ocr_page(indexed_page):
+                """在排程器的工作執行緒中對單頁進行 OCR"""
+                i, page_info = indexed_page
+                
+                # 先前已完成的頁面直接沿用日誌中的結果
+                if journal is not None:
+                    resumed = journal.get(f"page:{page_info['page_num']}")
+                    if resumed is not None:
+                        page_info['resumed'] = True
+                        return i, page_info, resumed['ocr_text']
                 
-                # 轉換為 base64
-                image_base64 = pdf_processor.image_to_base64(page_info['image'])
+                # 原生文字層已涵蓋整頁，不需要 OCR
+                if page_info['source'] == SOURCE_NATIVE:
+                    return i, page_info, ""
+                
+                # 依像素預算縮放並選擇上傳格式，再轉換為 base64（只編碼一次，之後由 VLM 客戶端沿用）
+                upload_image = image_preprocessor.process(page_info['image'])
+                image_base64 = pdf_processor.image_to_base64(upload_image)
                 
                 # 檢查 base64 數據是否有效
                 if not image_base64:
-                    logger.warning(f"第 {i+1} 頁 base64 轉換失敗，跳過 OCR")
-                    pages_ocr_results.append({
-                        'page_num': page_info['page_num'],
-                        'ocr_text': "頁面轉換失敗，無法進行 OCR"
-                    })
-                    continue
+                    return i, page_info, None
                 
                 # 使用 VLM 進行 OCR
-                ocr_text = ''
+                started = time.perf_counter()
                 if test_mode:
                     # 測試模式：模擬 OCR 結果
                     # ocr_text = f"第 {i+1} 頁的模擬 OCR 文字內容 - 這是一個測試結果"
@@ -227,77 +318,185 @@ def process_pdf_with_vlm(input_pdf_path: str, output_pdf_path: str, use_page_mod
                     4564564
                     4564564
                     """
+                elif stream_mode:
+                    # 串流模式：回應以「無文字內容」開頭時立即停止，並記錄 TTFT 與 tokens/sec
+                    ocr_result = vlm_client.analyze_image_streaming(upload_image, "ocr", stop_sentinel="無文字內容")
+                    ocr_text = ocr_result.get("content", "無文字內容") if ocr_result["success"] else "OCR 分析失敗"
                 else:
-                    ocr_result = vlm_client.analyze_image(image_base64, "ocr")
+                    ocr_result = vlm_client.analyze_image(upload_image, "ocr")
                     ocr_text = ocr_result.get("content", "無文字內容") if ocr_result["success"] else "OCR 分析失敗"
-                    print(f"OCR 結果: {ocr_text}")
                 
-                # 清洗並斷行，避免純數字長行寫入 PDF 失敗
-                sanitized_ocr = sanitize_text_for_pdf(ocr_text)
-                if sanitized_ocr != ocr_text:
-                    logger.info(f"第 {i+1} 頁 OCR 內容已清洗/斷行以適配 PDF")
-
-                pages_ocr_results.append({
-                    'page_num': page_info['page_num'],
-                    'ocr_text': sanitized_ocr
-                })
+                page_info['elapsed_ms'] = (time.perf_counter() - started) * 1000
+                page_info['cached'] = False if test_mode else ocr_result.get("cached", False)
+                return i, page_info, ocr_text
+            
+            def iter_pages_ocr_results(page_nums=None):
+                """串流產出每頁的 OCR 結果，邊渲染、邊請求、邊寫入註解"""
+                print(f"\n=== 頁面 OCR 結果 ===")
+                print(f"文件: {input_pdf_path}\n")
                 
-                # 打印 OCR 結果
-                print(f"第 {i+1} 頁 OCR 結果:")
-                print(f"  頁面尺寸: {page_info['width']}x{page_info['height']} 像素")
-                if ocr_text and ocr_text != "無文字內容" and ocr_text != "OCR 分析失敗":
-                    print(f"  識別文字: {ocr_text}")
-                else:
-                    print(f"  識別文字: {ocr_text}")
-                print("-" * 50)
+                # 先讀取原生文字層，只有缺少文字的頁面或圖片區域才渲染並送交 VLM
+                analyses = None
+                if text_layer is not None:
+                    analyses = text_layer.analyze_document(input_pdf_path, page_nums)
+                    logger.info(f"文字層分析: {TextLayerAnalyzer.summarize(analyses)}")
                 
-                logger.info(f"第 {i+1} 頁 OCR 完成")
-            
-            print(f"=== 頁面 OCR 完成 ===\n")
-            
-            # 創建增強的 PDF
-            logger.info("創建增強的 PDF...")
-            pdf_processor.create_enhanced_pdf_from_pages(input_pdf_path, pages_ocr_results, output_pdf_path)
+                # 逐頁渲染（每頁只渲染一次，同時供保存與 OCR 使用），
+                # 由排程器保持多個請求在途，結果仍按頁面順序返回
+                pages = pdf_processor.iter_pages_for_ocr(input_pdf_path, analyses, dpi=dpi, save_dir=pages_save_dir,
+                                                         page_nums=page_nums)
+                pages_count = 0
+                tile_results = []
+                tile_infos = []
+                for i, page_info, ocr_text in scheduler.imap(ocr_page, iter_ocr_units(pages)):
+                    # 同一頁的區塊按順序連續返回，全部到齊後拼接為整頁結果
+                    tile = page_info.get('tile')
+                    if tile is not None:
+                        tile_results.append((tile, ocr_text))
+                        tile_infos.append(page_info)
+                        if len(tile_results) < page_info['tile_count']:
+                            continue
+                        ocr_text = page_tiler.stitch(tile_results)
+                        page_info = dict(
+                            page_info,
+                            elapsed_ms=sum(info.get('elapsed_ms', 0) for info in tile_infos),
+                            cached=all(info.get('cached') for info in tile_infos)
+                        )
+                        tile_results = []
+                        tile_infos = []
+                        logger.info(f"第 {i+1} 頁由 {page_info['tile_count']} 個區塊拼接")
+                    
+                    pages_count += 1
+                    
+                    if sidecar is not None:
+                        sidecar.write(
+                            "page", page_info['page_num'],
+                            ocr_text=ocr_text if page_info['source'] != SOURCE_NATIVE else None,
+                            native_text=page_info['native_text'] or None,
+                            source=page_info['source'],
+                            cached=page_info.get('cached'),
+                            resumed=page_info.get('resumed', False),
+                            elapsed_ms=page_info.get('elapsed_ms'),
+                            tiles=page_info.get('tile_count')
+                        )
+                    
+                    if ocr_text is None:
+                        logger.warning(f"第 {i+1} 頁 base64 轉換失敗，跳過 OCR")
+                        yield {
+                            'page_num': page_info['page_num'],
+                            'ocr_text': "頁面轉換失敗，無法進行 OCR",
+                            'source': page_info['source']
+                        }
+                        continue
+                    
+                    if page_info['source'] == SOURCE_NATIVE:
+                        print(f"第 {i+1} 頁使用原生文字層（{len(page_info['native_text'])} 字），不需要 OCR")
+                        print("-" * 50)
+                        yield {
+                            'page_num': page_info['page_num'],
+                            'ocr_text': "",
+                            'source': SOURCE_NATIVE,
+                            'native_text': page_info['native_text']
+                        }
+                        continue
+                    
+                    if not test_mode:
+                        print(f"OCR 結果: {ocr_text}")
+                    
+                    # 失敗的頁面不記錄，重新執行時會再試一次
+                    if journal is not None and ocr_text != "OCR 分析失敗":
+                        journal.record(f"page:{page_info['page_num']}", {'ocr_text': ocr_text, 'source': page_info['source']})
+                    
+                    # 清洗並斷行，避免純數字長行寫入 PDF 失敗
+                    sanitized_ocr = sanitize_text_for_pdf(ocr_text)
+                    if sanitized_ocr != ocr_text:
+                        logger.info(f"第 {i+1} 頁 OCR 內容已清洗/斷行以適配 PDF")
+                    
+                    # 打印 OCR 結果
+                    print(f"第 {i+1} 頁 OCR 結果:")
+                    print(f"  頁面尺寸: {page_info['width']}x{page_info['height']} 像素")
+                    if page_info['source'] == SOURCE_HYBRID:
+                        print(f"  原生文字層 {len(page_info['native_text'])} 字，僅對圖片區域進行 OCR")
+                    if ocr_text and ocr_text != "無文字內容" and ocr_text != "OCR 分析失敗":
+                        print(f"  識別文字: {ocr_text}")
+                    else:
+                        print(f"  識別文字: {ocr_text}")
+                    print("-" * 50)
+                    
+                    logger.info(f"第 {i+1} 頁 OCR 完成")
+                    
+                    yield {
+                        'page_num': page_info['page_num'],
+                        'ocr_text': sanitized_ocr,
+                        'source': page_info['source'],
+                        'native_text': page_info['native_text']
+                    }
+                
+                print(f"總共 {pages_count} 頁")
+                print(f"=== 頁面 OCR 完成 ===\n")
             
-        else:
+            if mode == "page":
+                # 創建增強的 PDF，OCR 結果一產出就寫入註解
+                logger.info("創建增強的 PDF...")
+                pdf_processor.create_enhanced_pdf_from_pages(input_pdf_path, iter_pages_ocr_results(), output_pdf_path)
+                completed = True
+        
+        if mode in ("image", "auto"):
             # 圖片模式：提取個別圖片進行分析
             logger.info("使用圖片模式進行處理...")
             
-            # 提取圖片
-            images_info = pdf_processor.extract_images_from_pdf(input_pdf_path)
-            logger.info(f"找到 {len(images_info)} 張圖片")
+            # 逐張提取圖片（自動模式只提取選擇圖片模式的頁面），標記顯示面積過小的位置，再標記重複的圖片
+            images = pdf_processor.iter_images_from_pdf(input_pdf_path, page_nums=image_pages)
+            images = pdf_processor.mark_duplicate_images(image_filter.mark_small_placements(images))
+            first_image = next(images, None)
+            if first_image is not None:
+                images = itertools.chain([first_image], images)
             
-            if not images_info:
+            if first_image is None and mode == "image":
                 logger.info("PDF 中沒有找到圖片，直接複製原文件")
                 import shutil
                 shutil.copy2(input_pdf_path, output_pdf_path)
+                completed = True
                 return True
             
-            # 分析每張圖片
-            images_descriptions = []
-            
-            print(f"\n=== 圖片分析和 OCR 結果 ===")
-            print(f"文件: {input_pdf_path}")
-            print(f"總共 {len(images_info)} 張圖片\n")
+            def checkpoint_key(i, img_info):
+                """圖片位置在日誌中的鍵；提取順序固定，附上頁碼與 xref 以防錯位"""
+                return f"image:{i}:{img_info['page_num']}:{img_info['xref']}"
             
-            for i, img_info in enumerate(images_info):
-                logger.info(f"分析第 {i+1}/{len(images_info)} 張圖片...")
+            def analyze_image(indexed_image):
+                """在排程器的工作執行緒中分析單張圖片，重複的圖片不送出請求"""
+                i, img_info = indexed_image
+                
+                # 顯示面積過小的位置不送出請求
+                if img_info.get('skip_reason'):
+                    return i, img_info, {'skipped': img_info['skip_reason']}
+                
+                # 相同 xref 或相同內容的圖片只分析一次，由消費端沿用第一次的結果
+                if img_info['duplicate']:
+                    return i, img_info, None
+                
+                # 先前已完成的圖片直接沿用日誌中的結果
+                if journal is not None:
+                    resumed = journal.get(checkpoint_key(i, img_info))
+                    if resumed is not None:
+                        img_info['resumed'] = True
+                        return i, img_info, resumed
                 
-                # 轉換為 base64
-                image_base64 = pdf_processor.image_to_base64(img_info['image'])
+                # 像素過小或空白的圖片不送出請求
+                skip_reason = image_filter.check_image(img_info['image'])
+                if skip_reason:
+                    return i, img_info, {'skipped': skip_reason}
+                
+                # 依像素預算縮放並選擇上傳格式，再轉換為 base64（只編碼一次，之後由 VLM 客戶端沿用）
+                upload_image = image_preprocessor.process(img_info['image'])
+                image_base64 = pdf_processor.image_to_base64(upload_image)
                 
                 # 檢查 base64 數據是否有效
                 if not image_base64:
-                    logger.warning(f"圖片 {i+1} base64 轉換失敗，跳過分析")
-                    images_descriptions.append({
-                        'page_num': img_info['page_num'],
-                        'rect': img_info['rect'],
-                        'description': "圖片轉換失敗，無法分析",
-                        'ocr_text': "無法提取文字"
-                    })
-                    continue
+                    return i, img_info, None
                 
                 # 使用 VLM 分析
+                started = time.perf_counter()
                 if test_mode:
                     # 測試模式：模擬分析結果
                     analysis_result = {
@@ -305,40 +504,124 @@ def process_pdf_with_vlm(input_pdf_path: str, output_pdf_path: str, use_page_mod
                         'ocr_text': f"圖片 {i+1} 的模擬 OCR 文字" if i % 3 == 0 else "無文字內容"
                     }
                 else:
-                    analysis_result = vlm_client.get_image_description_and_ocr(image_base64)
+                    analysis_result = vlm_client.get_image_description_and_ocr(upload_image)
+                img_info['elapsed_ms'] = (time.perf_counter() - started) * 1000
                 
-                # 對描述與 OCR 文字做清洗
-                desc = sanitize_text_for_pdf(analysis_result.get('description', ''))
-                ocr_txt = sanitize_text_for_pdf(analysis_result.get('ocr_text', ''))
-                if desc != analysis_result.get('description', '') or ocr_txt != analysis_result.get('ocr_text', ''):
-                    logger.info(f"圖片 {i+1} 文字內容已清洗/斷行以適配 PDF")
-
-                images_descriptions.append({
-                    'page_num': img_info['page_num'],
-                    'rect': img_info['rect'],
-                    'description': desc,
-                    'ocr_text': ocr_txt
-                })
+                return i, img_info, analysis_result
+            
+            def iter_images_descriptions():
+                """串流產出每張圖片的分析結果，邊提取、邊請求、邊寫入註解"""
+                print(f"\n=== 圖片分析和 OCR 結果 ===")
+                print(f"文件: {input_pdf_path}\n")
                 
-                # 打印分析結果
-                print(f"圖片 {i+1} 分析結果:")
-                print(f"  頁面: {img_info['page_num'] + 1}")
-                print(f"  位置: x={img_info['rect'].x0:.1f}, y={img_info['rect'].y0:.1f}")
-                print(f"  尺寸: {img_info['image'].size[0]}x{img_info['image'].size[1]} 像素")
-                print(f"  描述: {analysis_result['description']}")
-                if analysis_result['ocr_text'] and analysis_result['ocr_text'] != "無文字內容":
-                    print(f"  OCR 文字: {analysis_result['ocr_text']}")
-                else:
-                    print(f"  OCR 文字: 無文字內容")
-                print("-" * 50)
+                # 唯一圖片的分析結果，供之後重複出現的位置沿用
+                results_by_hash = {}
+                images_count = 0
                 
-                logger.info(f"圖片 {i+1} 分析完成")
-            
-            print(f"=== 圖片分析完成 ===\n")
+                # 由排程器保持多個請求在途，結果仍按圖片順序返回
+                indexed_images = enumerate(images)
+                for i, img_info, analysis_result in scheduler.imap(analyze_image, indexed_images):
+                    images_count += 1
+                    key = img_info.get('image_hash') or ('xref', img_info['xref'])
+                    if img_info['duplicate']:
+                        analysis_result = results_by_hash.get(key)
+                    elif not img_info.get('skip_reason'):
+                        results_by_hash[key] = analysis_result
+                        if analysis_result is not None and not analysis_result.get('skipped'):
+                            image_filter.record_analyzed(key)
+
+                        # 失敗的圖片不記錄，重新執行時會再試一次
+                        if journal is not None and analysis_result is not None and not analysis_result.get('failed'):
+                            journal.record(checkpoint_key(i, img_info), analysis_result)
+                    
+                    if sidecar is not None:
+                        result = analysis_result or {}
+                        sidecar.write(
+                            "image", img_info['page_num'],
+                            rect=img_info['rect'],
+                            xref=img_info['xref'],
+                            image_hash=img_info.get('image_hash'),
+                            description=result.get('description'),
+                            ocr_text=result.get('ocr_text'),
+                            skipped=result.get('skipped'),
+                            duplicate=img_info['duplicate'],
+                            cached=result.get('cached', False) if 'description' in result else None,
+                            resumed=img_info.get('resumed', False),
+                            elapsed_ms=img_info.get('elapsed_ms')
+                        )
+                    
+                    if analysis_result is not None and analysis_result.get('skipped'):
+                        skip_reason = analysis_result['skipped']
+                        image_filter.record_skip(skip_reason, key)
+                        print(f"圖片 {i+1} 已略過: {skip_reason}")
+                        print(f"  頁面: {img_info['page_num'] + 1}")
+                        print(f"  位置: x={img_info['rect'].x0:.1f}, y={img_info['rect'].y0:.1f}")
+                        print("-" * 50)
+                        yield {
+                            'page_num': img_info['page_num'],
+                            'rect': img_info['rect'],
+                            'description': "",
+                            'ocr_text': "",
+                            'skipped': skip_reason
+                        }
+                        continue
+                    
+                    if analysis_result is None:
+                        logger.warning(f"圖片 {i+1} base64 轉換失敗，跳過分析")
+                        yield {
+                            'page_num': img_info['page_num'],
+                            'rect': img_info['rect'],
+                            'description': "圖片轉換失敗，無法分析",
+                            'ocr_text': "無法提取文字",
+                            'image_hash': img_info.get('image_hash')
+                        }
+                        continue
+                    
+                    # 對描述與 OCR 文字做清洗
+                    desc = sanitize_text_for_pdf(analysis_result.get('description', ''))
+                    ocr_txt = sanitize_text_for_pdf(analysis_result.get('ocr_text', ''))
+                    if desc != analysis_result.get('description', '') or ocr_txt != analysis_result.get('ocr_text', ''):
+                        logger.info(f"圖片 {i+1} 文字內容已清洗/斷行以適配 PDF")
+                    
+                    # 打印分析結果
+                    print(f"圖片 {i+1} 分析結果:")
+                    print(f"  頁面: {img_info['page_num'] + 1}")
+                    print(f"  位置: x={img_info['rect'].x0:.1f}, y={img_info['rect'].y0:.1f}")
+                    print(f"  尺寸: {img_info['image'].size[0]}x{img_info['image'].size[1]} 像素")
+                    if img_info['duplicate']:
+                        print(f"  （重複圖片，沿用先前的分析結果）")
+                    print(f"  描述: {analysis_result['description']}")
+                    if analysis_result['ocr_text'] and analysis_result['ocr_text'] != "無文字內容":
+                        print(f"  OCR 文字: {analysis_result['ocr_text']}")
+                    else:
+                        print(f"  OCR 文字: 無文字內容")
+                    print("-" * 50)
+                    
+                    logger.info(f"圖片 {i+1} 分析完成")
+                    
+                    yield {
+                        'page_num': img_info['page_num'],
+                        'rect': img_info['rect'],
+                        'description': desc,
+                        'ocr_text': ocr_txt,
+                        'image_hash': img_info.get('image_hash')
+                    }
+                
+                filter_stats = image_filter.stats()
+                print(f"總共 {images_count} 張圖片（{len(results_by_hash)} 張唯一圖片）")
+                print(f"預過濾略過 {filter_stats['skipped']} 張圖片，避免 {filter_stats['avoided_vlm_calls']} 次 VLM 請求")
+                print(f"=== 圖片分析完成 ===\n")
             
-            # 創建增強的 PDF
+            # 創建增強的 PDF，分析結果一產出就寫入註解
             logger.info("創建增強的 PDF...")
-            pdf_processor.create_enhanced_pdf(input_pdf_path, images_descriptions, output_pdf_path)
+            if mode == "image":
+                pdf_processor.create_enhanced_pdf(input_pdf_path, iter_images_descriptions(), output_pdf_path)
+            else:
+                # 兩種模式的結果寫入同一份輸出
+                pdf_processor.create_enhanced_pdf_combined(
+                    input_pdf_path, iter_images_descriptions(), iter_pages_ocr_results(page_pages), output_pdf_path
+                )
+            completed = True
         
         logger.info(f"處理完成！輸出文件: {output_pdf_path}")
         return True
@@ -346,90 +629,184 @@ def process_pdf_with_vlm(input_pdf_path: str, output_pdf_path: str, use_page_mod
     except Exception as e:
         logger.error(f"處理過程中發生錯誤: {str(e)}")
         return False
-
-def main():
-    """主函數"""
-    input_dir = Path("./input")
-    output_dir = Path("./output")
-    
-    # 確保目錄存在
-    input_dir.mkdir(exist_ok=True)
-    output_dir.mkdir(exist_ok=True)
-    
-    # 查找輸入目錄中的 PDF 文件
-    pdf_files = list(input_dir.glob("*.pdf"))
-    
-    if not pdf_files:
-        logger.info("在 input 目錄中沒有找到 PDF 文件")
-        logger.info("請將要處理的 PDF 文件放入 ./input 目錄")
-        return
     
-    # 首先打印所有 PDF 文件中的圖片信息並保存圖片
-    print("\n" + "="*50)
-    print("開始分析 PDF 文件中的圖片...")
-    print("="*50)
-    
-    pdf_images_data = {}  # 存儲每個PDF的圖片信息
+    finally:
+        if owns_scheduler:
+            scheduler.shutdown()
+        if journal is not None:
+            # 輸出完成後刪除日誌；失敗時保留，下次執行從中斷處繼續
+            journal.close(completed=completed)
+        if sidecar is not None:
+            sidecar.close()
+        logger.info(f"圖片前處理統計: {image_preprocessor.stats()}")
+        logger.info(f"圖片預過濾統計: {image_filter.stats()}")
+        logger.info(f"VLM 請求統計: {vlm_client.metrics()}")
+        vlm_client.close()
+        if vlm_cache is not None and owns_cache:
+            logger.info(f"VLM 快取統計: {vlm_cache.stats()}")
+            vlm_cache.close()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="使用 Qwen2.5-VL 為 PDF 加上圖片描述與 OCR 文字")
+    parser.add_argument("pdf_files", nargs="*", help="要處理的 PDF 文件，未指定時處理輸入目錄中的所有 PDF")
+    parser.add_argument("--input-dir", default="./input", help="輸入目錄（預設 ./input）")
+    parser.add_argument("--output-dir", default="./output", help="輸出目錄（預設 ./output）")
+    parser.add_argument("--mode", choices=["image", "page", "auto"],
+                        help="處理模式；指定後以非互動方式執行，auto 逐頁估計成本並選擇較省的方式")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="所有文件共用的 VLM 在途請求上限（預設讀取 VLM_MAX_CONCURRENCY）")
+    parser.add_argument("--jobs", type=int, default=1, help="同時處理的 PDF 數量（預設 1）")
+    parser.add_argument("--dpi", type=int, default=150, help="頁面模式的渲染解析度（預設 150）")
+    parser.add_argument("--cache-path", default=None,
+                        help="VLM 結果快取路徑，空字串表示停用（預設讀取 VLM_CACHE_PATH）")
+    parser.add_argument("--sidecar", default=None,
+                        help="結構化結果格式，逗號分隔的 jsonl、parquet，空字串表示停用（預設讀取 SIDECAR_FORMATS）")
+    parser.add_argument("--save-images", action="store_true", help="非互動模式下先保存 PDF 中的圖片")
+    parser.add_argument("--test", action="store_true", help="測試模式（模擬 OCR 結果，等同 TEST_MODE=true）")
+    return parser.parse_args(argv)
+
+def run_batch(pdf_files: list, output_dir: Path, args: argparse.Namespace, test_mode: bool) -> int:
+    """非互動模式：多份文件同時處理，共用同一個 VLM 請求排程器作為全域併發上限"""
+    if args.save_images:
+        for pdf_file in pdf_files:
+            print_pdf_images_info(str(pdf_file), save_images=True)
     
-    for pdf_file in pdf_files:
-        images_info = print_pdf_images_info(str(pdf_file))
-        pdf_images_data[str(pdf_file)] = images_info
+    def process_one(pdf_file: Path) -> bool:
+        output_file = output_dir / f"enhanced_{pdf_file.name}"
+        try:
+            success = process_pdf_with_vlm(str(pdf_file), str(output_file), test_mode=test_mode, scheduler=scheduler,
+                                           dpi=args.dpi, mode=args.mode, sidecar_formats=args.sidecar,
+                                           vlm_cache=vlm_cache)
+        except Exception as e:
+            logger.error(f"處理 {pdf_file.name} 時發生錯誤: {str(e)}")
+            success = False
         
-        # 如果有圖片，保存到資料夾
-        if images_info:
-            print(f"正在保存 {pdf_file.name} 的圖片...")
-            images_dir = save_images_to_folder(str(pdf_file), images_info)
-            if images_dir:
-                print(f"✅ 圖片已保存到: {images_dir}\n")
-            else:
-                print(f"❌ 保存圖片失敗\n")
+        if success:
+            logger.info(f"✅ {pdf_file.name} 處理成功")
         else:
-            print(f"📝 {pdf_file.name} 中沒有圖片需要保存\n")
-    
-    # 詢問用戶是否要繼續處理
-    print("圖片信息分析和保存完成！")
-    user_input = input("是否要繼續使用 VLM 處理這些 PDF？(y/n): ").lower().strip()
+            logger.error(f"❌ {pdf_file.name} 處理失敗")
+        return success
     
-    if user_input not in ['y', 'yes', '是']:
-        print("已取消 VLM 處理，但圖片已保存完成")
-        return
+    # 所有文件共用一個排程器與一個快取連線，併發上限與快取大小上限都對整個批次生效
+    scheduler = VLMRequestScheduler(args.concurrency)
+    vlm_cache = open_vlm_cache(args.cache_path, test_mode)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs), thread_name_prefix="pdf-job") as pool:
+            results = list(pool.map(process_one, pdf_files))
+    finally:
+        scheduler.shutdown()
+        if vlm_cache is not None:
+            logger.info(f"VLM 快取統計: {vlm_cache.stats()}")
+            vlm_cache.close()
     
-    # 處理每個 PDF 文件
+    failed = results.count(False)
+    logger.info(f"批次處理完成：{len(results) - failed} 個成功，{failed} 個失敗")
+    return 1 if failed else 0
+
+def process_interactive(pdf_files: list, pdf_images_count: dict, output_dir: Path, args: argparse.Namespace,
+                        test_mode: bool, scheduler: VLMRequestScheduler) -> int:
+    """互動流程：逐份文件詢問處理模式後處理"""
+    exit_code = 0
     for pdf_file in pdf_files:
-        images_info = pdf_images_data[str(pdf_file)]
-        use_page_mode = False
+        images_count = pdf_images_count[str(pdf_file)]
+        mode = "image"
         
         # 檢查圖片數量，如果超過 10 個則詢問用戶
-        if len(images_info) > 10:
-            print(f"\n📊 {pdf_file.name} 包含 {len(images_info)} 張圖片")
+        if images_count > 10:
+            print(f"\n📊 {pdf_file.name} 包含 {images_count} 張圖片")
             print("由於圖片數量較多，建議使用以下處理方式：")
             print("1. 圖片模式：逐一分析每張圖片（較詳細但耗時）")
             print("2. 頁面模式：將每頁轉換為圖片進行 OCR（較快速）")
+            print("3. 自動模式：逐頁估計成本，選擇請求較少的方式")
             
-            mode_choice = input("請選擇處理模式 (1=圖片模式, 2=頁面模式): ").strip()
+            mode_choice = input("請選擇處理模式 (1=圖片模式, 2=頁面模式, 3=自動模式): ").strip()
             
             if mode_choice == "2":
-                use_page_mode = True
+                mode = "page"
                 print(f"✅ 選擇頁面模式處理 {pdf_file.name}")
+            elif mode_choice == "3":
+                mode = "auto"
+                print(f"✅ 選擇自動模式處理 {pdf_file.name}")
             else:
                 print(f"✅ 選擇圖片模式處理 {pdf_file.name}")
         else:
-            print(f"\n📊 {pdf_file.name} 包含 {len(images_info)} 張圖片，使用圖片模式處理")
+            print(f"\n📊 {pdf_file.name} 包含 {images_count} 張圖片，使用圖片模式處理")
         
         output_file = output_dir / f"enhanced_{pdf_file.name}"
         logger.info(f"處理文件: {pdf_file.name}")
         
-        # 檢查是否要使用測試模式
-        test_mode = os.getenv("TEST_MODE", "false").lower() == "true"
         if test_mode:
             print("🧪 使用測試模式（模擬 OCR 結果）")
         
-        success = process_pdf_with_vlm(str(pdf_file), str(output_file), use_page_mode, test_mode)
+        success = process_pdf_with_vlm(str(pdf_file), str(output_file), test_mode=test_mode, scheduler=scheduler,
+                                       dpi=args.dpi, cache_path=args.cache_path, mode=mode,
+                                       sidecar_formats=args.sidecar)
         
         if success:
             logger.info(f"✅ {pdf_file.name} 處理成功")
         else:
             logger.error(f"❌ {pdf_file.name} 處理失敗")
+            exit_code = 1
+    
+    return exit_code
+
+def main(argv=None) -> int:
+    """主函數；未指定 --mode 時保留原本的互動流程"""
+    args = parse_args(argv)
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
+    
+    # 確保目錄存在
+    input_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    # 查找輸入目錄中的 PDF 文件
+    pdf_files = [Path(f) for f in args.pdf_files] if args.pdf_files else sorted(input_dir.glob("*.pdf"))
+    
+    if not pdf_files:
+        logger.info(f"在 {input_dir} 目錄中沒有找到 PDF 文件")
+        logger.info(f"請將要處理的 PDF 文件放入 {input_dir} 目錄")
+        return 0
+    
+    # 檢查是否要使用測試模式
+    test_mode = args.test or os.getenv("TEST_MODE", "false").lower() == "true"
+    
+    if args.mode is not None:
+        return run_batch(pdf_files, output_dir, args, test_mode)
+    
+    # 首先打印所有 PDF 文件中的圖片信息並保存圖片
+    print("\n" + "="*50)
+    print("開始分析 PDF 文件中的圖片...")
+    print("="*50)
+    
+    pdf_images_count = {}  # 只存儲每個PDF的圖片數量，不保留圖片本身
+    
+    for pdf_file in pdf_files:
+        images_count = print_pdf_images_info(str(pdf_file), save_images=True)
+        pdf_images_count[str(pdf_file)] = images_count
+        
+        if images_count:
+            print(f"✅ {pdf_file.name} 的圖片已保存到: {get_images_folder(str(pdf_file))}\n")
+        else:
+            print(f"📝 {pdf_file.name} 中沒有圖片需要保存\n")
+    
+    # 詢問用戶是否要繼續處理
+    print("圖片信息分析和保存完成！")
+    user_input = input("是否要繼續使用 VLM 處理這些 PDF？(y/n): ").lower().strip()
+    
+    if user_input not in ['y', 'yes', '是']:
+        print("已取消 VLM 處理，但圖片已保存完成")
+        return 0
+    
+    # 處理每個 PDF 文件；--concurrency 在互動流程中同樣作為 VLM 在途請求上限
+    scheduler = VLMRequestScheduler(args.concurrency)
+    try:
+        exit_code = process_interactive(pdf_files, pdf_images_count, output_dir, args, test_mode, scheduler)
+    finally:
+        scheduler.shutdown()
+    
+    return exit_code
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
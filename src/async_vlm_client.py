@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+非同步 VLM 客戶端模組
+以 asyncio 與 aiohttp 送出請求，單一事件迴圈即可驅動大量在途請求
+"""
+
+import os
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Union
+
+import aiohttp
+
+from vlm_cache import VLMResultCache
+from vlm_client import BaseVLMClient, RETRYABLE_STATUS_CODES
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+class AsyncQwenVLMClient(BaseVLMClient):
+    """
+    QwenVLMClient 的非同步版本，提示詞、快取與回應解析與同步客戶端共用
+
+    在途請求數由 semaphore 限制，可同時處理多份文件的圖片而不需每個請求一個執行緒
+    """
+
+    def __init__(self, api_url: Union[str, List[str]] = "http://localhost:8000", cache: Optional[VLMResultCache] = None,
+                 max_in_flight: int = None):
+        super().__init__(api_url, cache)
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv("VLM_MAX_CONCURRENCY", "8"))
+        self.max_in_flight = max(1, max_in_flight)
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """在目前的事件迴圈中建立連線池與 semaphore"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._session
+
+    async def close(self):
+        """關閉連線池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _post_chat_completion(self, payload: Dict):
+        """
+        送出 chat completion 請求，遇到連線錯誤、逾時、429 或 5xx 時以指數退避重試
+
+        Returns:
+            (狀態碼, 回應內容)；狀態碼為 200 時內容為 JSON，否則為文字
+        """
+        session = self._get_session()
+
+        for attempt in range(self.max_retries + 1):
+            self._count("requests")
+            retry_after = None
+
+            try:
+                async with self._semaphore:
+                    # 取得 semaphore 後才選擇端點，在途計數只包含真正送出的請求
+                    endpoint = self.endpoints.acquire()
+                    try:
+                        async with session.post(f"{endpoint}/v1/chat/completions", json=payload) as response:
+                            status = response.status
+                            retry_after = response.headers.get("Retry-After")
+                            body = await response.json() if status == 200 else await response.text()
+                    except BaseException:
+                        self.endpoints.release(endpoint, success=False)
+                        raise
+                    self.endpoints.release(endpoint, success=status not in RETRYABLE_STATUS_CODES)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                logger.warning(f"VLM 請求發生暫時性錯誤，準備重試 ({attempt+1}/{self.max_retries}): {endpoint}: {str(e)}")
+            else:
+                if status not in RETRYABLE_STATUS_CODES:
+                    if status != 200:
+                        self._count("failures")
+                    return status, body
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    return status, body
+                logger.warning(f"VLM 請求返回 {status}，準備重試 ({attempt+1}/{self.max_retries})")
+
+            self._count("retries")
+            await asyncio.sleep(self._retry_delay(attempt, retry_after))
+
+    async def analyze_image(self, image_base64: Union[str, ImagePayload], prompt_type: str = "description",
+                            use_cache: bool = True) -> Dict[str, str]:
+        """非同步版本的 QwenVLMClient.analyze_image"""
+        early_result, payload, cache_key = self._prepare_request(image_base64, prompt_type, use_cache)
+        if early_result is not None:
+            return early_result
+
+        try:
+            status, body = await self._post_chat_completion(payload)
+
+            if status == 200:
+                return self._handle_completion(body, prompt_type, cache_key)
+            else:
+                logger.error(f"API 請求失敗: {status}, {body}")
+                return {"success": False, "error": f"API 錯誤: {status}"}
+
+        except Exception as e:
+            logger.error(f"VLM 分析失敗: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def get_image_description_and_ocr(self, image_base64: Union[str, ImagePayload],
+                                            combined: bool = None) -> Dict[str, str]:
+        """非同步版本的 QwenVLMClient.get_image_description_and_ocr"""
+        if self._use_combined_mode(combined):
+            # 單次請求同時取得描述與 OCR，圖片只需上傳與編碼一次
+            parsed = self._parse_combined_result(await self.analyze_image(image_base64, "combined"))
+            if parsed is not None:
+                return parsed
+
+        # 描述與 OCR 互不相依，同時送出
+        desc_result, ocr_result = await asyncio.gather(
+            self.analyze_image(image_base64, "description"),
+            self.analyze_image(image_base64, "ocr")
+        )
+
+        return self._merge_separate_results(desc_result, ocr_result)
+
+    async def analyze_many(self, images: Iterable[Union[str, ImagePayload]], prompt_type: str = "ocr") -> List[Dict[str, str]]:
+        """同時分析多張圖片，結果順序與輸入相同；在途請求數受 max_in_flight 限制"""
+        return await asyncio.gather(*(self.analyze_image(image, prompt_type) for image in images))
+
+    async def describe_many(self, images: Iterable[Union[str, ImagePayload]], combined: bool = None) -> List[Dict[str, str]]:
+        """同時取得多張圖片的描述與 OCR，結果順序與輸入相同"""
+        return await asyncio.gather(*(self.get_image_description_and_ocr(image, combined) for image in images))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+處理進度日誌模組
+以只追加的 JSONL 記錄每個已完成的圖片或頁面結果，程序中斷後重新執行時跳過已完成的部分
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def file_fingerprint(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """以檔案內容計算 sha256，PDF 被替換或修改後舊的進度不會被誤用"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CheckpointJournal:
+    """
+    單一 PDF、單一處理模式的進度日誌
+
+    第一行為檔頭（PDF 指紋與處理模式），之後每行一個已完成單位的結果。
+    每筆記錄寫入後立即 flush，程序被中止時最多遺失最後一行；
+    寫到一半的行在載入時忽略
+    """
+
+    def __init__(self, pdf_path: str, mode: str, journal_dir: str = None):
+        if journal_dir is None:
+            journal_dir = os.getenv("CHECKPOINT_DIR", "./temp/checkpoints")
+
+        self.pdf_path = pdf_path
+        self.mode = mode
+        self.fingerprint = file_fingerprint(pdf_path)
+        self.path = Path(journal_dir) / f"{Path(pdf_path).stem}.{mode}.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._results = self._load()
+        self.resumed = len(self._results)
+
+        # 指紋不符或日誌不存在時重新開始
+        if not self._results:
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._write({"type": "header", "fingerprint": self.fingerprint, "mode": mode})
+        else:
+            self._file = open(self.path, "a", encoding="utf-8")
+            logger.info(f"從進度日誌恢復 {self.resumed} 個已完成的項目: {self.path}")
+
+    def _load(self) -> Dict[str, Dict]:
+        """讀取既有日誌；檔頭與目前的 PDF 不符時返回空字典"""
+        if not self.path.exists():
+            return {}
+
+        results = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_num, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"進度日誌第 {line_num+1} 行不完整，已忽略")
+                    continue
+
+                if line_num == 0:
+                    if (record.get("type") != "header" or record.get("fingerprint") != self.fingerprint
+                            or record.get("mode") != self.mode):
+                        logger.info(f"PDF 已變更或處理模式不同，捨棄舊的進度日誌: {self.path}")
+                        return {}
+                    continue
+
+                results[record["key"]] = record["result"]
+        return results
+
+    def _write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """返回已完成單位的結果，未完成時返回 None"""
+        with self._lock:
+            return self._results.get(key)
+
+    def record(self, key: str, result: Dict):
+        """記錄一個已完成的單位"""
+        with self._lock:
+            if key in self._results:
+                return
+            self._results[key] = result
+            self._write({"key": key, "result": result})
+
+    def close(self, completed: bool = False):
+        """
+        關閉日誌；completed 為 True 表示輸出已寫入完成，日誌不再需要並會被刪除
+        （CHECKPOINT_KEEP=true 時保留）
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+            if completed and os.getenv("CHECKPOINT_KEEP", "false").lower() != "true":
+                self.path.unlink(missing_ok=True)
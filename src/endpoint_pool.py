@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+VLM 端點池模組
+在多個 vLLM 伺服器之間以最少在途請求分配負載，連續失敗的端點暫時移出，冷卻後再試
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Union
+
+logger = logging.getLogger(__name__)
+
+def parse_endpoints(api_urls: Union[str, List[str]]) -> List[str]:
+    """將逗號分隔的字串或列表整理為端點網址列表"""
+    if isinstance(api_urls, str):
+        api_urls = api_urls.split(",")
+    urls = [url.strip().rstrip("/") for url in api_urls if url and url.strip()]
+    if not urls:
+        raise ValueError("至少需要一個 VLM 端點")
+    return urls
+
+class EndpointPool:
+    """
+    最少在途請求的端點選擇
+
+    連續失敗 failure_threshold 次的端點會被移出 eject_seconds 秒；冷卻結束後
+    只放行一個探測請求，成功即重新加入，失敗則再次移出
+    """
+
+    def __init__(self, urls: List[str], failure_threshold: int = None, eject_seconds: float = None):
+        if failure_threshold is None:
+            failure_threshold = int(os.getenv("VLM_EJECT_FAILURES", "3"))
+        if eject_seconds is None:
+            eject_seconds = float(os.getenv("VLM_EJECT_SECONDS", "30"))
+
+        self.urls = parse_endpoints(urls)
+        self.failure_threshold = max(1, failure_threshold)
+        self.eject_seconds = eject_seconds
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._state = {
+            url: {
+                "outstanding": 0,
+                "consecutive_failures": 0,
+                "ejected_until": 0.0,
+                "probing": False,
+                "requests": 0,
+                "failures": 0,
+                "ejections": 0,
+            }
+            for url in self.urls
+        }
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def acquire(self) -> str:
+        """
+        選出在途請求最少的可用端點並計入一個在途請求
+
+        所有端點都被移出時仍選擇最早恢復的一個，避免請求完全無處可送
+        """
+        with self._lock:
+            now = time.monotonic()
+            # 冷卻結束但探測請求尚未返回的端點不再放行其他請求
+            candidates = [
+                url for url in self.urls
+                if self._state[url]["ejected_until"] <= now and not self._state[url]["probing"]
+            ]
+            if not candidates:
+                candidates = [min(self.urls, key=lambda u: self._state[u]["ejected_until"])]
+
+            # 從輪替位置開始比較，在途數相同時平均分配
+            start = self._next % len(self.urls)
+            self._next += 1
+            ordered = sorted(candidates, key=lambda u: (self._state[u]["outstanding"],
+                                                        (self.urls.index(u) - start) % len(self.urls)))
+            url = ordered[0]
+
+            state = self._state[url]
+            if state["consecutive_failures"] >= self.failure_threshold:
+                state["probing"] = True
+            state["outstanding"] += 1
+            state["requests"] += 1
+            return url
+
+    def release(self, url: str, success: bool):
+        """請求結束時呼叫，依結果更新端點健康狀態"""
+        with self._lock:
+            state = self._state[url]
+            state["outstanding"] = max(0, state["outstanding"] - 1)
+            was_probing = state["probing"]
+            state["probing"] = False
+
+            if success:
+                if state["consecutive_failures"] >= self.failure_threshold:
+                    logger.info(f"VLM 端點已恢復: {url}")
+                state["consecutive_failures"] = 0
+                state["ejected_until"] = 0.0
+                return
+
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            if state["consecutive_failures"] >= self.failure_threshold and (
+                    was_probing or state["ejected_until"] == 0.0):
+                state["ejected_until"] = time.monotonic() + self.eject_seconds
+                state["ejections"] += 1
+                logger.warning(f"VLM 端點連續失敗 {state['consecutive_failures']} 次，暫停使用 {self.eject_seconds:.0f} 秒: {url}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """返回各端點的請求、失敗、移出次數與目前狀態"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                url: {
+                    "requests": state["requests"],
+                    "failures": state["failures"],
+                    "ejections": state["ejections"],
+                    "outstanding": state["outstanding"],
+                    "healthy": state["ejected_until"] <= now,
+                }
+                for url, state in self._state.items()
+            }
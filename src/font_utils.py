@@ -4,18 +4,75 @@
 處理中文字體相關功能
 """
 
+import os
+import json
+import math
 import fitz
 import logging
+import threading
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 class FontManager:
-    """字體管理器"""
+    """
+    字體管理器
     
-    def __init__(self):
-        self.available_fonts = self._get_available_fonts()
-        self.chinese_font = self._find_chinese_font()
+    字體在第一次使用時才解析，結果依 PyMuPDF 版本快取到磁碟，
+    之後的進程（包含進程池的子進程）不需要再逐一測試字體
+    """
+    
+    def __init__(self, cache_path: str = None):
+        if cache_path is None:
+            cache_path = os.getenv("FONT_CACHE_PATH", "./temp/font_cache.json")
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._available_fonts = None
+        self._chinese_font = None
+        self._lock = threading.Lock()
+    
+    @property
+    def available_fonts(self):
+        """PyMuPDF 支持的字體列表，第一次存取時才讀取"""
+        if self._available_fonts is None:
+            self._available_fonts = self._get_available_fonts()
+        return self._available_fonts
+    
+    @property
+    def chinese_font(self):
+        """可用的中文字體，第一次存取時才解析"""
+        if self._chinese_font is None:
+            with self._lock:
+                if self._chinese_font is None:
+                    self._chinese_font = self._load_cached_font() or self._find_chinese_font()
+        return self._chinese_font
+    
+    def _load_cached_font(self):
+        """讀取目前 PyMuPDF 版本已解析的字體，沒有快取時返回 None"""
+        if self.cache_path is None or not self.cache_path.exists():
+            return None
+        try:
+            cached = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.debug(f"字體快取無法讀取: {str(e)}")
+            return None
+        return cached.get(fitz.VersionBind)
+    
+    def _save_cached_font(self, font_name):
+        """將解析結果寫入快取；以暫存檔取代，避免多個進程同時寫入時讀到不完整的內容"""
+        if self.cache_path is None:
+            return
+        try:
+            cached = {}
+            if self.cache_path.exists():
+                cached = json.loads(self.cache_path.read_text(encoding="utf-8"))
+            cached[fitz.VersionBind] = font_name
+            
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(cached), encoding="utf-8")
+            os.replace(tmp_path, self.cache_path)
+        except (OSError, ValueError) as e:
+            logger.debug(f"字體快取無法寫入: {str(e)}")
     
     def _get_available_fonts(self):
         """獲取可用字體列表"""
@@ -47,9 +104,11 @@ class FontManager:
         for font in chinese_fonts:
             if self._test_font(font):
                 logger.info(f"找到可用的中文字體: {font}")
+                self._save_cached_font(font)
                 return font
         
         logger.warning("未找到專用的中文字體，將使用默認字體")
+        self._save_cached_font("helv")
         return "helv"  # 回退到默認字體
     
     def _test_font(self, font_name):
@@ -92,6 +151,10 @@ class FontManager:
                 return True
         return False
     
+    def document_writer(self, doc) -> "DocumentFontWriter":
+        """為一份輸出文件建立共用字體的文字寫入器"""
+        return DocumentFontWriter(doc, self)
+    
     def insert_text_with_font(self, page, rect, text, fontsize=8, color=(0, 0, 1)):
         """使用適當的字體插入文字"""
         font_name = self.get_best_font_for_text(text)
@@ -126,5 +189,146 @@ class FontManager:
                 logger.error(f"插入文字完全失敗: {str(e2)}")
                 return False
 
-# 全局字體管理器實例
+class DocumentFontWriter:
+    """
+    單一輸出文件的文字寫入器，整份文件共用一個嵌入字體；頁面放不下的文字接續寫入頁面註解
+    
+    第一次寫入時以 fitz.Font 載入字體並 insert_font；PyMuPDF 以內容辨識已插入的字體，
+    之後的頁面只加入對同一字體物件的引用，不會逐頁重複嵌入。
+    字體無法載入時改用內建字體名稱（不嵌入），行為與 FontManager.insert_text_with_font 相同
+    """
+    
+    FONT_ALIAS = "annot-cjk"
+    OVERFLOW_MARKER = "…（其餘內容見頁面註解）"
+    LAYOUT_HEIGHT_RATIO = 0.95
+    
+    def __init__(self, doc, manager: "FontManager", embed: bool = None, font_file: str = None):
+        if embed is None:
+            embed = os.getenv("ANNOTATION_EMBED_FONT", "true").lower() == "true"
+        if font_file is None:
+            font_file = os.getenv("ANNOTATION_FONT_FILE", "")
+        
+        self.doc = doc
+        self.manager = manager
+        self.min_fontsize = float(os.getenv("ANNOTATION_MIN_FONTSIZE", "3"))
+        self._font_buffer = self._load_font(font_file) if embed else None
+        self._registered_pages = set()
+    
+    @property
+    def embedded(self) -> bool:
+        """是否使用嵌入字體"""
+        return self._font_buffer is not None
+    
+    def _load_font(self, font_file: str):
+        """載入要嵌入的字體：優先使用 ANNOTATION_FONT_FILE，否則使用 PyMuPDF 內建的 CJK 字體"""
+        try:
+            font = fitz.Font(fontfile=font_file) if font_file else fitz.Font("cjk")
+            return font.buffer
+        except Exception as e:
+            logger.warning(f"無法載入嵌入字體 {font_file or 'cjk'}，改用內建字體名稱: {str(e)}")
+            return None
+    
+    def insert_text(self, page, rect, text, fontsize=8, color=(0, 0, 1)) -> bool:
+        """以文件共用的字體插入文字，失敗時回退到默認字體"""
+        if not self.embedded:
+            return self.manager.insert_text_with_font(page, rect, text, fontsize=fontsize, color=color)
+        
+        try:
+            if page.number not in self._registered_pages:
+                page.insert_font(fontname=self.FONT_ALIAS, fontbuffer=self._font_buffer)
+                self._registered_pages.add(page.number)
+            
+            # insert_textbox 估計高度時使用的行距比實際寫入的小（內建 CJK 字體約 4%），
+            # 長文字的最後幾行會超出文字框甚至頁面；以縮短的文字框排版，實際內容才會落在 rect 內
+            rect = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * self.LAYOUT_HEIGHT_RATIO)
+            
+            # 文字放不下時 insert_textbox 不會寫入任何內容並返回缺少的高度（負值），
+            # 依缺少的比例縮小字體再排版一次，每頁的排版次數有上限
+            rc = page.insert_textbox(rect, text, fontsize=fontsize, color=color, fontname=self.FONT_ALIAS)
+            if rc < 0 and fontsize > self.min_fontsize:
+                scale = math.sqrt(rect.height / (rect.height - rc)) * 0.95
+                fontsize = max(self.min_fontsize, fontsize * scale)
+                rc = page.insert_textbox(rect, text, fontsize=fontsize, color=color, fontname=self.FONT_ALIAS)
+            if rc < 0 and fontsize > self.min_fontsize:
+                fontsize = self.min_fontsize
+                rc = page.insert_textbox(rect, text, fontsize=fontsize, color=color, fontname=self.FONT_ALIAS)
+
+            # 最小字體仍放不下時，頁面上寫入放得下的前段，其餘內容寫入頁面註解，不捨棄任何文字
+            if rc < 0:
+                return self._insert_with_overflow(page, rect, text, fontsize, color)
+            
+            logger.debug(f"使用文件字體插入文字成功: {text[:30]}...")
+            return True
+        except Exception as e:
+            logger.warning(f"使用文件字體插入文字失敗，改用內建字體: {str(e)}")
+            return self.manager.insert_text_with_font(page, rect, text, fontsize=fontsize, color=color)
+    
+    def _insert_with_overflow(self, page, rect, text, fontsize, color) -> bool:
+        """
+        二分搜尋放得下的最長前段寫入頁面，剩餘的內容寫入頁面右上角的文字註解
+        
+        有空行分隔的段落時以段落為單位切分（同一張圖片的描述與文字不會被拆開），否則以行為單位；
+        搜尋時只以 Shape 排版測試，確定切分位置後才寫入頁面一次；註解不受頁面空間限制
+        """
+        separator = "\n\n" if "\n\n" in text else "\n"
+        parts = text.split(separator)
+        low, high = 0, len(parts) - 1  # 可寫入頁面的段數範圍
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._fits(page, rect, separator.join(parts[:middle]) + self.OVERFLOW_MARKER, fontsize):
+                low = middle
+            else:
+                high = middle - 1
+        
+        if low > 0:
+            page.insert_textbox(rect, separator.join(parts[:low]) + self.OVERFLOW_MARKER,
+                                fontsize=fontsize, color=color, fontname=self.FONT_ALIAS)
+        remainder = separator.join(parts[low:]).strip()
+        
+        annot = page.add_text_annot(fitz.Point(rect.x1 - 16, rect.y0), remainder, icon="Note")
+        annot.set_colors(stroke=color)
+        annot.update()
+        logger.warning(f"頁面 {page.number+1} 的文字超出可用空間（字體 {fontsize:.1f}），"
+                       f"其餘 {len(parts) - low} 段寫入頁面註解")
+        return True
+    
+    def _fits(self, page, rect, text, fontsize) -> bool:
+        """只排版不寫入：Shape 未 commit 前不會改變頁面內容"""
+        shape = page.new_shape()
+        return shape.insert_textbox(rect, text, fontsize=fontsize, fontname=self.FONT_ALIAS) >= 0
+    
+    def embedded_font_bytes(self) -> int:
+        """文件中所有嵌入字體的字節數"""
+        total = 0
+        seen = set()
+        for page_num in range(len(self.doc)):
+            for font in self.doc.get_page_fonts(page_num):
+                xref, ext = font[0], font[1]
+                if xref in seen or ext == "n/a":
+                    continue
+                seen.add(xref)
+                total += len(self.doc.extract_font(xref)[3])
+        return total
+    
+    def subset(self) -> bool:
+        """
+        只保留實際用到的字形，儲存時需搭配 garbage 回收舊的完整字體
+        
+        Returns:
+            是否進行了子集化
+        """
+        if not self.embedded or os.getenv("PDF_SUBSET_FONTS", "true").lower() != "true":
+            return False
+        
+        before = self.embedded_font_bytes()
+        try:
+            self.doc.subset_fonts()
+        except Exception as e:
+            logger.warning(f"字體子集化失敗，保留完整字體: {str(e)}")
+            return False
+        after = self.embedded_font_bytes()
+        logger.info(f"嵌入字體子集化: {before} → {after} 字節")
+        return True
+
+# 全局字體管理器實例（建立時不解析字體，匯入此模組沒有額外成本）
 font_manager = FontManager()
\ No newline at end of file
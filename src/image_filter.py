@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+圖片預過濾模組
+在送出 VLM 請求前略過過小的裝飾圖片與空白/近乎單色的圖片
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+import numpy as np
+from PIL import Image
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+# 空白偵測時縮小到的邊長；需保留細筆畫（小字、印章），過小的縮圖會把筆畫平均掉
+BLANK_SAMPLE_SIZE = 1024
+
+class ImageFilter:
+    """VLM 請求前的圖片預過濾"""
+
+    def __init__(self, min_rect_area: float = None, min_pixel_size: int = None, blank_std: float = None,
+                 blank_tolerance: float = None, blank_min_ink: float = None, calls_per_image: int = 1):
+        if min_rect_area is None:
+            min_rect_area = float(os.getenv("FILTER_MIN_RECT_AREA", "100"))
+        if min_pixel_size is None:
+            min_pixel_size = int(os.getenv("FILTER_MIN_PIXEL_SIZE", "16"))
+        if blank_std is None:
+            blank_std = float(os.getenv("FILTER_BLANK_STD", "3.0"))
+        if blank_tolerance is None:
+            blank_tolerance = float(os.getenv("FILTER_BLANK_TOLERANCE", "24"))
+        if blank_min_ink is None:
+            blank_min_ink = float(os.getenv("FILTER_BLANK_MIN_INK", "0.0002"))
+
+        self.min_rect_area = min_rect_area      # 頁面上的顯示面積（點²）
+        self.min_pixel_size = min_pixel_size    # 圖片寬或高的最小像素
+        self.blank_std = blank_std              # 灰階標準差達到此值時直接視為有內容
+        self.blank_tolerance = blank_tolerance  # 與背景（中位數）灰階差超過此值的像素視為內容
+        self.blank_min_ink = blank_min_ink      # 內容像素比例低於此值才視為空白
+        self.calls_per_image = calls_per_image  # 每張圖片原本需要的 VLM 請求數
+
+        self._lock = threading.Lock()
+        self._skipped = {}
+        self._skipped_hashes = set()
+        self._analyzed_hashes = set()
+
+    def mark_small_placements(self, images_info: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        依頁面上的顯示面積標記過小的位置
+
+        被標記的項目會帶有 'skip_reason'；面積是位置的屬性而非圖片內容，
+        所以在去重之前判斷，同一張圖片的其他較大位置仍會被分析
+        """
+        for img_info in images_info:
+            rect = img_info['rect']
+            area = rect.width * rect.height
+            if area < self.min_rect_area:
+                img_info['skip_reason'] = f"顯示面積過小 ({area:.1f} < {self.min_rect_area:.0f} 點²)"
+            yield img_info
+
+    def check_image(self, payload: ImagePayload) -> Optional[str]:
+        """檢查圖片內容，應略過時返回原因，否則返回 None"""
+        width, height = payload.size
+        if min(width, height) < self.min_pixel_size:
+            return f"像素尺寸過小 ({width}x{height})"
+
+        return self.check_blank(payload)
+
+    def check_blank(self, payload: ImagePayload) -> Optional[str]:
+        """
+        判斷是否為空白或近乎單色的圖片
+
+        標準差足夠大時直接保留；否則計算與背景灰階差異明顯的像素比例，
+        白底上的一行小字或印章標準差很低，但內容像素比例仍高於門檻
+        """
+        try:
+            sample = payload.image.convert("L")
+            sample.thumbnail((BLANK_SAMPLE_SIZE, BLANK_SAMPLE_SIZE), Image.BILINEAR)
+            pixels = np.asarray(sample, dtype=np.float32)
+        except Exception as e:
+            logger.debug(f"空白偵測失敗，保留圖片: {str(e)}")
+            return None
+
+        std = float(pixels.std())
+        if std >= self.blank_std:
+            return None
+
+        background = float(np.median(pixels))
+        ink = float(np.mean(np.abs(pixels - background) > self.blank_tolerance))
+        if ink >= self.blank_min_ink:
+            return None
+        return f"空白或近乎單色 (灰階標準差 {std:.2f}，內容像素 {ink:.4%})"
+
+    def record_skip(self, reason: str, image_hash: str = None):
+        """記錄一次略過，image_hash 用於估計避免的 VLM 請求數（同一張圖片只計一次）"""
+        category = reason.split(" (")[0]
+        with self._lock:
+            self._skipped[category] = self._skipped.get(category, 0) + 1
+            if image_hash is not None:
+                self._skipped_hashes.add(image_hash)
+
+    def record_analyzed(self, image_hash: str):
+        """記錄一張已送交 VLM 的圖片；同一張圖片在其他位置被略過時不計入避免的請求"""
+        with self._lock:
+            self._analyzed_hashes.add(image_hash)
+
+    def stats(self) -> Dict:
+        """返回略過統計與避免的 VLM 請求數（只計算所有位置都被略過的圖片）"""
+        with self._lock:
+            avoided = len(self._skipped_hashes - self._analyzed_hashes)
+            return {
+                "skipped": sum(self._skipped.values()),
+                "by_reason": dict(self._skipped),
+                "avoided_vlm_calls": avoided * self.calls_per_image,
+            }
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+圖片負載模組
+攜帶 PyMuPDF 一次編碼好的圖片字節，只有在真正需要時才解碼為 PIL Image
+"""
+
+import io
+import base64
+import struct
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 各格式的檔頭簽名
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+# 小於此大小的圖片數據視為無效
+MIN_IMAGE_BYTES = 20
+
+class ImagePayload:
+    """已編碼的圖片數據，延遲解碼為 PIL Image"""
+
+    def __init__(self, data: bytes, mime: str = "image/png", width: int = None, height: int = None, mode: str = None):
+        self.data = data
+        self.mime = mime
+        self._width = width
+        self._height = height
+        self._mode = mode
+        self._image = None
+        self._base64 = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pixmap(cls, pix) -> "ImagePayload":
+        """由 fitz.Pixmap 建立，只進行一次 PNG 編碼"""
+        colors = pix.n - pix.alpha
+        if colors == 1:
+            mode = "LA" if pix.alpha else "L"
+        else:
+            mode = "RGBA" if pix.alpha else "RGB"
+        return cls(pix.tobytes("png"), "image/png", pix.width, pix.height, mode)
+
+    @property
+    def nbytes(self) -> int:
+        """編碼後的字節數"""
+        return len(self.data)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """圖片尺寸 (寬, 高)，優先使用已知尺寸或檔頭資訊，避免解碼"""
+        if self._width is None or self._height is None:
+            header_size = self._read_png_size()
+            if header_size is not None:
+                self._width, self._height = header_size
+            else:
+                self._width, self._height = self.image.size
+        return self._width, self._height
+
+    @property
+    def mode(self) -> str:
+        """圖片模式（L、RGB 等）"""
+        if self._mode is None:
+            self._mode = self.image.mode
+        return self._mode
+
+    @property
+    def image(self) -> Image.Image:
+        """
+        延遲解碼的 PIL Image，第一次存取時才解碼
+
+        Image.open 只讀取檔頭，像素在第一次使用時才載入；同一張圖片可能由多個工作執行緒同時
+        convert 或 save，因此在鎖內完整載入後才交出，避免多個執行緒同時觸發載入
+        """
+        with self._lock:
+            if self._image is None:
+                image = Image.open(io.BytesIO(self.data))
+                image.load()
+                self._image = image
+            return self._image
+
+    def _read_png_size(self) -> Optional[Tuple[int, int]]:
+        """從 PNG 的 IHDR 區塊讀取尺寸"""
+        if self.mime != "image/png" or len(self.data) < 24 or not self.data.startswith(PNG_SIGNATURE):
+            return None
+        width, height = struct.unpack(">II", self.data[16:24])
+        return width, height
+
+    def validate(self) -> Optional[str]:
+        """直接在原始字節上驗證圖片，有效時返回 None，否則返回錯誤訊息"""
+        if not self.data:
+            return "圖片數據為空"
+
+        if len(self.data) < MIN_IMAGE_BYTES:
+            return f"圖片數據太小: {len(self.data)} 字節，可能無效"
+
+        if self.mime == "image/png":
+            if not self.data.startswith(PNG_SIGNATURE) or self.data[12:16] != b"IHDR":
+                return "PNG 檔頭無效"
+            width, height = self._read_png_size()
+            if width <= 0 or height <= 0:
+                return f"無效的圖片尺寸: {(width, height)}"
+        elif self.mime == "image/jpeg":
+            if not self.data.startswith(JPEG_SIGNATURE):
+                return "JPEG 檔頭無效"
+        elif self.mime == "image/webp":
+            if self.data[:4] != b"RIFF" or self.data[8:12] != b"WEBP":
+                return "WebP 檔頭無效"
+
+        return None
+
+    def to_base64(self) -> str:
+        """返回 base64 字串，只計算一次"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    def save(self, path, format: str = None):
+        """保存圖片；格式與編碼一致時直接寫入原始字節，不重新編碼"""
+        path = Path(path)
+        encoded_format = self.mime.split("/")[-1].upper()
+        target_format = (format or path.suffix.lstrip(".")).upper()
+        if target_format == "JPG":
+            target_format = "JPEG"
+
+        if target_format == encoded_format:
+            path.write_bytes(self.data)
+        else:
+            self.image.save(path, format)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+圖片前處理模組
+上傳前依 Qwen2.5-VL 的像素限制縮小過大的圖片，並可改用 JPEG/WebP 編碼
+"""
+
+import io
+import os
+import math
+import logging
+import threading
+from typing import Dict, Tuple
+from PIL import Image
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+# Qwen2.5-VL 以 28x28 像素為一個視覺 token
+PATCH_FACTOR = 28
+
+# 預設上限為 4096 個視覺 token，為 --max-model-len 8192 保留提示與輸出空間
+DEFAULT_MAX_PIXELS = 4096 * PATCH_FACTOR * PATCH_FACTOR
+DEFAULT_MIN_PIXELS = 4 * PATCH_FACTOR * PATCH_FACTOR
+
+FORMAT_MIME = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+def fit_to_pixel_budget(width: int, height: int, min_pixels: int, max_pixels: int,
+                        factor: int = PATCH_FACTOR) -> Tuple[int, int]:
+    """
+    等比例縮小尺寸使總像素不超過 max_pixels，並對齊 factor 的倍數
+
+    與 Qwen2.5-VL 處理器的 smart_resize 一致，但只縮小不放大；
+    不超過上限的圖片原樣返回，交由伺服器處理
+    """
+    if width * height <= max_pixels:
+        return width, height
+
+    scale = math.sqrt(max_pixels / (width * height))
+    new_width = max(factor, math.floor(width * scale / factor) * factor)
+    new_height = max(factor, math.floor(height * scale / factor) * factor)
+
+    # 對齊後仍不能低於模型的最小像素
+    if new_width * new_height < min_pixels:
+        scale = math.sqrt(min_pixels / (new_width * new_height))
+        new_width = math.ceil(new_width * scale / factor) * factor
+        new_height = math.ceil(new_height * scale / factor) * factor
+
+    return new_width, new_height
+
+class ImagePreprocessor:
+    """上傳前的圖片縮放與格式選擇"""
+
+    def __init__(self, max_pixels: int = None, min_pixels: int = None, image_format: str = None, quality: int = None):
+        if max_pixels is None:
+            max_pixels = int(os.getenv("VLM_MAX_PIXELS", str(DEFAULT_MAX_PIXELS)))
+        if min_pixels is None:
+            min_pixels = int(os.getenv("VLM_MIN_PIXELS", str(DEFAULT_MIN_PIXELS)))
+        if image_format is None:
+            image_format = os.getenv("VLM_IMAGE_FORMAT", "png")
+        if quality is None:
+            quality = int(os.getenv("VLM_IMAGE_QUALITY", "85"))
+
+        image_format = image_format.lower()
+        if image_format == "jpg":
+            image_format = "jpeg"
+        if image_format not in FORMAT_MIME:
+            logger.warning(f"不支援的圖片格式 {image_format}，改用 png")
+            image_format = "png"
+
+        self.max_pixels = max_pixels
+        self.min_pixels = min_pixels
+        self.image_format = image_format
+        self.quality = quality
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "images": 0,
+            "resized": 0,
+            "reencoded": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+
+    def process(self, payload: ImagePayload) -> ImagePayload:
+        """返回適合上傳的圖片；不需要處理時直接返回原本的 payload，不重新編碼"""
+        width, height = payload.size
+        target_size = fit_to_pixel_budget(width, height, self.min_pixels, self.max_pixels)
+        needs_resize = target_size != (width, height)
+        needs_reencode = FORMAT_MIME[self.image_format] != payload.mime
+
+        result = payload
+        if needs_resize or needs_reencode:
+            try:
+                result = self._encode(payload, target_size if needs_resize else None)
+            except Exception as e:
+                logger.warning(f"圖片前處理失敗，使用原始圖片: {str(e)}")
+                result = payload
+
+            # 只換格式卻沒有變小時，保留原始編碼
+            if not needs_resize and result.nbytes >= payload.nbytes:
+                result = payload
+
+        with self._lock:
+            self._stats["images"] += 1
+            self._stats["bytes_in"] += payload.nbytes
+            self._stats["bytes_out"] += result.nbytes
+            if result is not payload:
+                self._stats["reencoded"] += 1
+                if needs_resize:
+                    self._stats["resized"] += 1
+
+        if needs_resize and result is not payload:
+            logger.debug(f"圖片由 {width}x{height} 縮小為 {target_size[0]}x{target_size[1]}")
+
+        return result
+
+    def _encode(self, payload: ImagePayload, target_size) -> ImagePayload:
+        """縮放並以設定的格式重新編碼"""
+        image = payload.image
+        if target_size is not None:
+            image = image.resize(target_size, Image.LANCZOS)
+
+        save_kwargs = {}
+        if self.image_format == "jpeg":
+            # JPEG 不支援透明通道與調色盤
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            save_kwargs = {"quality": self.quality, "optimize": True}
+        elif self.image_format == "webp":
+            save_kwargs = {"quality": self.quality}
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format.upper(), **save_kwargs)
+        return ImagePayload(buffer.getvalue(), FORMAT_MIME[self.image_format], image.size[0], image.size[1], image.mode)
+
+    def stats(self) -> Dict:
+        """返回前處理統計，包含節省的上傳字節數"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        stats["saved_ratio"] = round(stats["bytes_saved"] / stats["bytes_in"], 4) if stats["bytes_in"] else 0.0
+        return stats
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+處理模式規劃模組
+逐頁估計圖片模式與頁面模式的 VLM 成本，為每一頁選擇較省的方式
+"""
+
+import os
+import logging
+from typing import Dict, List
+
+import fitz  # PyMuPDF
+from image_preprocess import PATCH_FACTOR, DEFAULT_MAX_PIXELS, DEFAULT_MIN_PIXELS
+
+logger = logging.getLogger(__name__)
+
+def vision_tokens(width: float, height: float, min_pixels: int, max_pixels: int) -> int:
+    """估計圖片上傳後佔用的視覺 token 數（每 28x28 像素一個，並受像素上下限約束）"""
+    pixels = min(max(width * height, min_pixels), max_pixels)
+    return max(1, int(pixels // (PATCH_FACTOR * PATCH_FACTOR)))
+
+class ModePlanner:
+    """
+    以 token 數估計每頁兩種模式的成本
+
+    圖片模式：每張需要分析的唯一圖片 calls_per_image 次請求（每次都有提示 + 視覺 token，加上描述與文字輸出）；
+    頁面模式：整頁渲染後一次請求（提示 + 頁面視覺 token + 全頁文字輸出）。
+    只讀取頁面的圖片列表、顯示位置與像素尺寸，不解碼任何圖片
+    """
+
+    def __init__(self, dpi: int = 150, max_pixels: int = None, min_pixels: int = None,
+                 prompt_tokens: int = None, image_output_tokens: int = None, page_output_tokens: int = None,
+                 min_rect_area: float = 100, min_pixel_size: int = 16, calls_per_image: int = 1):
+        if max_pixels is None:
+            max_pixels = int(os.getenv("VLM_MAX_PIXELS", str(DEFAULT_MAX_PIXELS)))
+        if min_pixels is None:
+            min_pixels = int(os.getenv("VLM_MIN_PIXELS", str(DEFAULT_MIN_PIXELS)))
+        if prompt_tokens is None:
+            prompt_tokens = int(os.getenv("PLANNER_PROMPT_TOKENS", "300"))
+        if image_output_tokens is None:
+            image_output_tokens = int(os.getenv("PLANNER_IMAGE_OUTPUT_TOKENS", "300"))
+        if page_output_tokens is None:
+            page_output_tokens = int(os.getenv("PLANNER_PAGE_OUTPUT_TOKENS", "800"))
+
+        self.dpi = dpi
+        self.max_pixels = max_pixels
+        self.min_pixels = min_pixels
+        self.prompt_tokens = prompt_tokens              # 每次請求的系統與使用者提示
+        self.image_output_tokens = image_output_tokens  # 每張圖片的描述與文字輸出
+        self.page_output_tokens = page_output_tokens    # 每頁的文字輸出
+        self.min_rect_area = min_rect_area              # 與 ImageFilter 相同，過小的位置不會送出請求
+        self.min_pixel_size = min_pixel_size
+        self.calls_per_image = calls_per_image          # 與 ImageFilter 相同，非合併模式描述與 OCR 各一次請求
+
+    def plan(self, pdf_path: str) -> List[Dict]:
+        """
+        為每一頁選擇處理模式
+
+        Returns:
+            每頁一項，包含 page_num、mode（"image"、"page" 或 "none"）、image_count、
+            unique_images、coverage（圖片顯示面積佔頁面的比例）、image_cost、page_cost
+        """
+        doc = fitz.open(pdf_path)
+        zoom = self.dpi / 72  # 72 是 PDF 的默認 DPI
+
+        # 已在圖片模式頁面分析過的圖片，之後重複出現時不再計入成本
+        analyzed_xrefs = set()
+        plans = []
+
+        try:
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+                page_area = page.rect.width * page.rect.height
+
+                image_count = 0
+                covered_area = 0.0
+                new_xrefs = {}
+                for img in page.get_images(full=True):
+                    xref, width, height = img[0], img[2], img[3]
+                    for rect in page.get_image_rects(xref):
+                        image_count += 1
+                        area = (rect & page.rect).get_area() if rect.intersects(page.rect) else 0.0
+                        covered_area += area
+                        if area < self.min_rect_area or min(width, height) < self.min_pixel_size:
+                            continue
+                        if xref not in analyzed_xrefs:
+                            new_xrefs[xref] = (width, height)
+
+                # 每次請求都重新預填提示與視覺 token；輸出總量與請求次數無關
+                image_cost = sum(
+                    (self.prompt_tokens + vision_tokens(w, h, self.min_pixels, self.max_pixels)) * self.calls_per_image
+                    + self.image_output_tokens
+                    for w, h in new_xrefs.values()
+                )
+                page_cost = (
+                    self.prompt_tokens
+                    + vision_tokens(page.rect.width * zoom, page.rect.height * zoom, self.min_pixels, self.max_pixels)
+                    + self.page_output_tokens
+                )
+
+                # 沒有需要分析的圖片時兩種模式都不需要請求（與原本的圖片模式相同）
+                if not new_xrefs:
+                    mode = "none"
+                elif image_cost <= page_cost:
+                    mode = "image"
+                    analyzed_xrefs.update(new_xrefs)
+                else:
+                    mode = "page"
+
+                plans.append({
+                    'page_num': page_num,
+                    'mode': mode,
+                    'image_count': image_count,
+                    'unique_images': len(new_xrefs),
+                    'coverage': round(min(1.0, covered_area / page_area), 4) if page_area else 0.0,
+                    'image_cost': image_cost,
+                    'page_cost': page_cost
+                })
+        finally:
+            doc.close()
+
+        return plans
+
+    @staticmethod
+    def summarize(plans: List[Dict]) -> Dict:
+        """統計各模式的頁數，以及依計畫與全部使用單一模式時的估計 token 數"""
+        chosen = {"image": 0, "page": 0, "none": 0}
+        for plan in plans:
+            chosen[plan['mode']] += 1
+        return {
+            "pages": chosen,
+            "planned_tokens": sum(
+                plan['image_cost'] if plan['mode'] == "image" else plan['page_cost'] if plan['mode'] == "page" else 0
+                for plan in plans
+            ),
+            "image_mode_tokens": sum(plan['image_cost'] for plan in plans),
+            "page_mode_tokens": sum(plan['page_cost'] for plan in plans),
+        }
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+頁面分塊 OCR 模組
+將高解析度的頁面切成互相重疊的區塊分別 OCR，再依閱讀順序拼接並去除重疊區的重複文字
+"""
+
+import io
+import os
+import math
+import logging
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from image_payload import ImagePayload
+from image_preprocess import PATCH_FACTOR
+
+logger = logging.getLogger(__name__)
+
+# 預設每個區塊最多 1280 個視覺 token
+DEFAULT_TILE_PIXELS = 1280 * PATCH_FACTOR * PATCH_FACTOR
+
+# 相鄰區塊的文字視為同一行的相似度門檻
+LINE_SIMILARITY = 0.8
+
+NO_TEXT = "無文字內容"
+OCR_FAILED = "OCR 分析失敗"
+
+def _normalize_line(line: str) -> str:
+    return "".join(line.split())
+
+def _lines_match(a: str, b: str) -> bool:
+    """比較兩行是否相同；OCR 對被裁切的行可能略有差異，以相似度判斷"""
+    a, b = _normalize_line(a), _normalize_line(b)
+    if not a or not b:
+        return False
+    if a == b:
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= LINE_SIMILARITY
+
+def drop_overlap(previous: str, following: str, max_lines: int) -> str:
+    """
+    去除 following 開頭與 previous 結尾重複的行
+
+    兩個相鄰區塊的重疊區會被 OCR 兩次，取兩者之間最長的重複行數後從 following 移除
+    """
+    prev_lines = [line for line in previous.splitlines() if line.strip()]
+    next_lines = following.splitlines()
+    next_indexes = [index for index, line in enumerate(next_lines) if line.strip()]
+
+    limit = min(max_lines, len(prev_lines), len(next_indexes))
+    for count in range(limit, 0, -1):
+        tail = prev_lines[-count:]
+        head = [next_lines[index] for index in next_indexes[:count]]
+        if all(_lines_match(a, b) for a, b in zip(tail, head)):
+            return "\n".join(next_lines[next_indexes[count - 1] + 1:]).strip("\n")
+    return following
+
+class PageTiler:
+    """
+    將頁面圖片切成上下重疊的整寬橫條並拼接各橫條的 OCR 結果
+
+    只做水平切分：每個橫條都包含完整的文字行，拼接時只需依上下順序去除重疊區的重複行
+    """
+
+    def __init__(self, tile_pixels: int = None, overlap: int = None, dedup_lines: int = None):
+        if tile_pixels is None:
+            tile_pixels = int(os.getenv("TILE_MAX_PIXELS", str(DEFAULT_TILE_PIXELS)))
+        if overlap is None:
+            overlap = int(os.getenv("TILE_OVERLAP", "64"))
+        if dedup_lines is None:
+            dedup_lines = int(os.getenv("TILE_DEDUP_LINES", "6"))
+
+        self.tile_pixels = tile_pixels  # 每個區塊的像素上限（含重疊）
+        self.overlap = overlap          # 相鄰區塊重疊的像素
+        self.dedup_lines = dedup_lines  # 去除重複時最多比較的行數
+
+    def rows(self, width: int, height: int) -> int:
+        """
+        計算橫條數
+
+        頁面過寬、像素上限容不下足夠高的橫條時，以重疊區的四倍作為最小高度，
+        每個橫條可能略超過上限，交由前處理縮小
+        """
+        band_height = max(self.tile_pixels // max(1, width), self.overlap * 4)
+        return max(1, math.ceil((height - self.overlap) / (band_height - self.overlap)))
+
+    def split(self, payload: ImagePayload) -> List[Dict]:
+        """
+        將頁面圖片切成橫條；不超過像素上限時返回只含原圖的單一區塊
+
+        Returns:
+            由上而下排列的區塊，每項包含 row、box 與 image
+        """
+        width, height = payload.size
+        if width * height <= self.tile_pixels:
+            return [{'row': 0, 'box': (0, 0, width, height), 'image': payload}]
+
+        rows = self.rows(width, height)
+        if rows == 1:
+            return [{'row': 0, 'box': (0, 0, width, height), 'image': payload}]
+        step_y = math.ceil((height - self.overlap) / rows)
+
+        image = payload.image
+        tiles = []
+        for row in range(rows):
+            y0 = row * step_y
+            y1 = min(height, y0 + step_y + self.overlap)
+
+            buffer = io.BytesIO()
+            tile_image = image.crop((0, y0, width, y1))
+            tile_image.save(buffer, format="PNG")
+            tiles.append({
+                'row': row,
+                'box': (0, y0, width, y1),
+                'image': ImagePayload(buffer.getvalue(), "image/png", width, y1 - y0, tile_image.mode)
+            })
+
+        logger.debug(f"頁面 {width}x{height} 切成 {rows} 個橫條")
+        return tiles
+
+    def stitch(self, tile_results: List[Tuple[Dict, Optional[str]]]) -> str:
+        """
+        由上而下拼接各橫條的 OCR 結果，並去除與上一個橫條重疊區重複的行
+
+        任一區塊失敗時整頁視為失敗，避免不完整的結果被當作完成
+        """
+        ordered = sorted(tile_results, key=lambda item: item[0]['row'])
+        if any(text is None or text == OCR_FAILED for _, text in ordered):
+            return OCR_FAILED
+
+        merged = ""
+        for _, text in ordered:
+            text = text.strip()
+            if not text or text == NO_TEXT:
+                continue
+            if merged:
+                text = drop_overlap(merged, text, self.dedup_lines)
+                if text:
+                    merged += "\n" + text
+            else:
+                merged = text
+
+        return merged or NO_TEXT
@@ -4,89 +4,164 @@ import os
 import base64
 from PIL import Image
 import io
-from typing import List, Dict, Tuple
+import shutil
+import tempfile
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Union
 from pathlib import Path
 import logging
 from font_utils import font_manager
+from image_payload import ImagePayload
+from pdf_workers import (
+    chunk_page_numbers, iter_page_images, extract_page_range_images, restore_extracted_image,
+    render_page_range, load_rendered_page
+)
 
 logger = logging.getLogger(__name__)
 
 class PDFProcessor:
-    def __init__(self, temp_dir: str = "./temp"):
+    def __init__(self, temp_dir: str = "./temp", render_workers: int = None, render_chunk_size: int = None,
+                 extract_workers: int = None, extract_chunk_size: int = None, save_mode: str = None):
         self.temp_dir = temp_dir
         os.makedirs(temp_dir, exist_ok=True)
+        
+        # 頁面渲染的進程數與每個任務的頁數，進程數為 1 時使用單進程渲染
+        if render_workers is None:
+            render_workers = int(os.getenv("RENDER_WORKERS", "1"))
+        if render_chunk_size is None:
+            render_chunk_size = int(os.getenv("RENDER_CHUNK_SIZE", "4"))
+        self.render_workers = max(1, render_workers)
+        self.render_chunk_size = max(1, render_chunk_size)
+        
+        # 圖片提取的進程數與每個任務的頁數，進程數為 1 時使用單進程提取
+        if extract_workers is None:
+            extract_workers = int(os.getenv("EXTRACT_WORKERS", "1"))
+        if extract_chunk_size is None:
+            extract_chunk_size = int(os.getenv("EXTRACT_CHUNK_SIZE", "8"))
+        self.extract_workers = max(1, extract_workers)
+        self.extract_chunk_size = max(1, extract_chunk_size)
+        
+        # 增強 PDF 的保存方式：full 重寫整份文件，incremental 複製原始文件後只附加註解的變更
+        if save_mode is None:
+            save_mode = os.getenv("PDF_SAVE_MODE", "full")
+        if save_mode not in ("full", "incremental"):
+            logger.warning(f"不支援的保存模式 {save_mode}，改用 full")
+            save_mode = "full"
+        self.save_mode = save_mode
+        self.save_deflate = os.getenv("PDF_SAVE_DEFLATE", "true").lower() == "true"
+        self.save_garbage = int(os.getenv("PDF_SAVE_GARBAGE", "0") or 0)
     
     def extract_images_from_pdf(self, pdf_path: str) -> List[Dict]:
         """從 PDF 中提取圖片及其位置信息"""
+        return list(self.iter_images_from_pdf(pdf_path))
+    
+    def iter_images_from_pdf(self, pdf_path: str, page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """逐張產出 PDF 中的圖片及其位置信息，記憶體用量不隨文件大小增長
+        
+        每個項目的 'image' 為 ImagePayload，攜帶已編碼的 PNG 字節並延遲解碼；
+        提供 page_nums 時只提取這些頁面
+        """
+        if self.extract_workers > 1:
+            yield from self._iter_images_multiprocess(pdf_path, page_nums)
+            return
+        
         doc = fitz.open(pdf_path)
-        images_info = []
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            image_list = page.get_images()
+        # 同一 xref 在多個頁面重複引用時只解碼一次，快取大小有上限
+        decoded_xrefs = OrderedDict()
+        
+        try:
+            for page_num in (range(len(doc)) if page_nums is None else sorted(page_nums)):
+                yield from iter_page_images(doc, page_num, decoded_xrefs)
+        finally:
+            doc.close()
+    
+    def _iter_images_multiprocess(self, pdf_path: str, page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """以進程池分段提取圖片，依 (page_num, img_index) 順序合併，結果與單進程版本一致"""
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+        
+        chunks = chunk_page_numbers(page_count, self.extract_chunk_size, page_nums)
+        logger.info(f"使用 {self.extract_workers} 個進程提取 {page_count} 頁的圖片（每段 {self.extract_chunk_size} 頁）")
+        
+        # 相同內容的圖片在主進程共用一個 ImagePayload；範圍與單進程的 xref 快取相同，
+        # 只在同一段頁面內共用，避免記憶體隨文件大小增長
+        for records in self._iter_chunks_in_pool(self.extract_workers, extract_page_range_images, chunks, pdf_path):
+            payloads = {}
+            # 子進程依頁面與圖片順序產出，排序僅作為合併時的保險
+            records.sort(key=lambda record: (record['page_num'], record['img_index']))
+            for record in records:
+                yield restore_extracted_image(record, payloads)
+    
+    def _iter_chunks_in_pool(self, workers: int, func, chunks: List[List[int]], *args) -> Iterator:
+        """
+        在進程池中對每個頁面區塊執行 func(*args, chunk)，並按區塊順序產出結果
+        
+        同一時間最多只有 workers * 2 個區塊在處理或等待讀取，記憶體用量有上限
+        """
+        # 使用 spawn 避免在已有 VLM 請求執行緒的進程中 fork
+        context = multiprocessing.get_context("spawn")
+        
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            pending = deque()
+            chunk_iter = iter(chunks)
             
-            for img_index, img in enumerate(image_list):
-                try:
-                    # 獲取圖片數據
-                    xref = img[0]
-                    pix = fitz.Pixmap(doc, xref)
-                    
-                    if pix.n - pix.alpha < 4:  # 確保不是 CMYK
-                        # 轉換為 PIL Image
-                        img_data = pix.tobytes("png")
-                        
-                        # 驗證圖片數據
-                        if len(img_data) == 0:
-                            logger.warning(f"頁面 {page_num+1} 圖片 {img_index+1} 數據為空，跳過")
-                            pix = None
-                            continue
-                        
-                        try:
-                            pil_image = Image.open(io.BytesIO(img_data))
-                            
-                            # 驗證圖片是否有效
-                            if pil_image.size[0] <= 0 or pil_image.size[1] <= 0:
-                                logger.warning(f"頁面 {page_num+1} 圖片 {img_index+1} 尺寸無效: {pil_image.size}")
-                                pix = None
-                                continue
-                            
-                            # 嘗試驗證圖片數據完整性
-                            pil_image.verify()
-                            # 重新加載圖片（verify 後需要重新加載）
-                            pil_image = Image.open(io.BytesIO(img_data))
-                            
-                        except Exception as e:
-                            logger.warning(f"頁面 {page_num+1} 圖片 {img_index+1} 無法解析: {str(e)}")
-                            pix = None
-                            continue
-                        
-                        # 獲取圖片在頁面中的位置
-                        img_rects = page.get_image_rects(xref)
-                        
-                        for rect in img_rects:
-                            images_info.append({
-                                'page_num': page_num,
-                                'image': pil_image,
-                                'rect': rect,
-                                'xref': xref,
-                                'img_index': img_index
-                            })
-                    
-                    pix = None
-                    
-                except Exception as e:
-                    logger.error(f"處理頁面 {page_num+1} 圖片 {img_index+1} 時發生錯誤: {str(e)}")
-                    continue
+            def submit_next():
+                page_nums = next(chunk_iter, None)
+                if page_nums is not None:
+                    pending.append(executor.submit(func, *args, page_nums))
+            
+            for _ in range(workers * 2):
+                submit_next()
+            
+            while pending:
+                result = pending.popleft().result()
+                submit_next()
+                yield result
+    
+    def mark_duplicate_images(self, images_info: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        依內容雜湊（缺少時改用 xref）標記重複的圖片，每張唯一圖片只需分析一次
         
-        doc.close()
-        return images_info
+        產出的每個項目會多出 'duplicate' 欄位：第一次出現為 False，
+        之後相同內容的項目為 True，可直接沿用第一次的分析結果；
+        已帶有 'skip_reason' 的位置不會被分析，因此不視為第一次出現
+        """
+        seen_keys = set()
+        total = 0
+        
+        for img_info in images_info:
+            total += 1
+            if img_info.get('skip_reason'):
+                img_info['duplicate'] = False
+                yield img_info
+                continue
+            
+            key = img_info.get('image_hash') or ('xref', img_info['xref'])
+            img_info['duplicate'] = key in seen_keys
+            seen_keys.add(key)
+            yield img_info
+        
+        logger.info(f"圖片去重: {total} 個位置對應 {len(seen_keys)} 張唯一圖片")
     
-    def image_to_base64(self, image: Image.Image) -> str:
-        """將 PIL Image 轉換為 base64 字符串"""
+    def image_to_base64(self, image: Union[ImagePayload, Image.Image]) -> str:
+        """將圖片轉換為 base64 字符串
+        
+        ImagePayload 直接使用已編碼的字節；PIL Image 才需要重新編碼為 PNG
+        """
         if image is None:
             logger.error("收到空的圖片對象")
             return ""
         
+        if isinstance(image, ImagePayload):
+            error = image.validate()
+            if error:
+                logger.error(f"圖片數據無效: {error}")
+                return ""
+            return image.to_base64()
+        
         try:
             # 驗證圖片尺寸
             if image.size[0] <= 0 or image.size[1] <= 0:
@@ -121,60 +196,249 @@ class PDFProcessor:
     
     def convert_pages_to_images(self, pdf_path: str, dpi: int = 150) -> List[Dict]:
         """將 PDF 頁面轉換為圖片"""
+        return list(self.iter_pages_as_images(pdf_path, dpi))
+    
+    def iter_pages_as_images(self, pdf_path: str, dpi: int = 150, save_dir: Optional[str] = None,
+                             page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """逐頁渲染並產出頁面圖片，記憶體中只保留少量頁面
+        
+        render_workers 大於 1 時以進程池分段渲染，產出順序與單進程相同
+        
+        Args:
+            pdf_path: PDF 文件路徑
+            dpi: 渲染解析度
+            save_dir: 若提供，渲染後同時將頁面 PNG 寫入 {save_dir}/{pdf 名稱}_pages，
+                不需要為保存再渲染一次
+            page_nums: 若提供，只渲染這些頁面
+        """
+        pages_dir = self.get_pages_dir(pdf_path, save_dir) if save_dir else None
+        
+        if self.render_workers > 1:
+            yield from self._iter_pages_multiprocess(pdf_path, dpi, pages_dir, page_nums)
+        else:
+            yield from self._iter_pages_serial(pdf_path, dpi, pages_dir, page_nums)
+        
+        if pages_dir is not None:
+            logger.info(f"✅ 所有頁面已保存到: {pages_dir}")
+    
+    def _iter_pages_serial(self, pdf_path: str, dpi: int, pages_dir: Optional[Path],
+                           page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """在目前進程中逐頁渲染"""
         doc = fitz.open(pdf_path)
-        pages_info = []
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # 設置縮放比例以控制圖片質量
-            zoom = dpi / 72  # 72 是 PDF 的默認 DPI
-            mat = fitz.Matrix(zoom, zoom)
-            
-            # 渲染頁面為圖片
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
-            pil_image = Image.open(io.BytesIO(img_data))
-            
-            pages_info.append({
-                'page_num': page_num,
-                'image': pil_image,
-                'width': pil_image.size[0],
-                'height': pil_image.size[1]
-            })
-            
-            pix = None
+        # 設置縮放比例以控制圖片質量
+        zoom = dpi / 72  # 72 是 PDF 的默認 DPI
+        mat = fitz.Matrix(zoom, zoom)
         
-        doc.close()
-        return pages_info
+        try:
+            for page_num in (range(len(doc)) if page_nums is None else sorted(page_nums)):
+                page = doc[page_num]
+                
+                # 渲染頁面為圖片，只編碼一次
+                pix = page.get_pixmap(matrix=mat)
+                payload = ImagePayload.from_pixmap(pix)
+                pix = None
+                
+                # 已編碼的 PNG 直接寫入磁碟，與 OCR 共用同一次渲染
+                if pages_dir is not None:
+                    payload.save(pages_dir / f"page_{page_num+1:03d}.png", 'PNG')
+                
+                yield {
+                    'page_num': page_num,
+                    'image': payload,
+                    'width': payload.size[0],
+                    'height': payload.size[1]
+                }
+        finally:
+            doc.close()
     
-    def save_pages_as_images(self, pdf_path: str, output_dir: str, dpi: int = 150) -> str:
-        """將 PDF 頁面保存為圖片文件"""
+    def _iter_pages_multiprocess(self, pdf_path: str, dpi: int, pages_dir: Optional[Path],
+                                 page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """
+        以進程池分段渲染頁面，每個子進程開啟自己的 fitz 文件
+        
+        渲染結果經由暫存檔傳回，並按頁碼順序產出
+        """
+        with fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+        
+        chunks = chunk_page_numbers(page_count, self.render_chunk_size, page_nums)
+        render_dir = tempfile.mkdtemp(prefix="render_", dir=self.temp_dir)
+        logger.info(f"使用 {self.render_workers} 個進程渲染 {page_count} 頁（每段 {self.render_chunk_size} 頁）")
+        
+        try:
+            for results in self._iter_chunks_in_pool(self.render_workers, render_page_range, chunks, pdf_path, dpi, render_dir):
+                for result in results:
+                    page_num = result['page_num']
+                    keep_path = pages_dir / f"page_{page_num+1:03d}.png" if pages_dir is not None else None
+                    payload = load_rendered_page(result, keep_path)
+                    
+                    yield {
+                        'page_num': page_num,
+                        'image': payload,
+                        'width': result['width'],
+                        'height': result['height']
+                    }
+        finally:
+            shutil.rmtree(render_dir, ignore_errors=True)
+    
+    def iter_pages_for_ocr(self, pdf_path: str, analyses: Optional[List[Dict]] = None, dpi: int = 150,
+                           save_dir: Optional[str] = None, page_nums: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        """
+        依文字層分析結果按頁碼順序產出需要 OCR 的內容
+        
+        每個項目帶有 'source' 與 'native_text'：
+        native 頁面不渲染（'image' 為 None），vlm 頁面整頁渲染，
+        hybrid 頁面只渲染需要 OCR 的區域（'region'）；
+        未提供 analyses 時所有頁面都整頁渲染
+        """
+        if analyses is None:
+            for page_info in self.iter_pages_as_images(pdf_path, dpi, save_dir=save_dir, page_nums=page_nums):
+                page_info.update(source="vlm", native_text="")
+                yield page_info
+            return
+        
+        full_pages = [analysis['page_num'] for analysis in analyses if analysis['source'] == "vlm"]
+        rendered = self.iter_pages_as_images(pdf_path, dpi, save_dir=save_dir, page_nums=full_pages)
+        
+        zoom = dpi / 72  # 72 是 PDF 的默認 DPI
+        mat = fitz.Matrix(zoom, zoom)
+        doc = fitz.open(pdf_path)
+        
+        try:
+            for analysis in sorted(analyses, key=lambda a: a['page_num']):
+                page_info = {
+                    'page_num': analysis['page_num'],
+                    'source': analysis['source'],
+                    'native_text': analysis['native_text'],
+                    'image': None
+                }
+                
+                if analysis['source'] == "vlm":
+                    # 整頁渲染的結果與 full_pages 同樣按頁碼排序
+                    page_info.update(next(rendered))
+                elif analysis['source'] == "hybrid":
+                    pix = doc[analysis['page_num']].get_pixmap(matrix=mat, clip=analysis['region'])
+                    payload = ImagePayload.from_pixmap(pix)
+                    pix = None
+                    page_info.update(image=payload, width=payload.size[0], height=payload.size[1],
+                                     region=analysis['region'])
+                
+                yield page_info
+        finally:
+            doc.close()
+            rendered.close()
+    
+    def get_pages_dir(self, pdf_path: str, output_dir: str) -> Path:
+        """返回並建立保存頁面圖片的資料夾"""
         pdf_name = Path(pdf_path).stem
         pages_dir = Path(output_dir) / f"{pdf_name}_pages"
         pages_dir.mkdir(parents=True, exist_ok=True)
+        return pages_dir
+    
+    def save_pages_as_images(self, pdf_path: str, output_dir: str, dpi: int = 150) -> str:
+        """將 PDF 頁面保存為圖片文件"""
+        for _ in self.iter_pages_as_images(pdf_path, dpi, save_dir=output_dir):
+            pass
         
-        pages_info = self.convert_pages_to_images(pdf_path, dpi)
-        
-        for page_info in pages_info:
-            page_num = page_info['page_num'] + 1
-            filename = f"page_{page_num:03d}.png"
-            image_path = pages_dir / filename
-            page_info['image'].save(image_path, 'PNG')
-        
-        logger.info(f"✅ 所有頁面已保存到: {pages_dir}")
-        return str(pages_dir)
+        return str(self.get_pages_dir(pdf_path, output_dir))
 
-    def create_enhanced_pdf(self, original_pdf_path: str, images_descriptions: List[Dict], output_path: str):
+    def create_enhanced_pdf(self, original_pdf_path: str, images_descriptions: Iterable[Dict], output_path: str):
         """創建包含圖片描述的增強 PDF"""
-        doc = fitz.open(original_pdf_path)
+        self._write_enhanced_pdf(
+            original_pdf_path, output_path,
+            lambda doc, fonts: self._annotate_images(doc, images_descriptions, fonts)
+        )
+    
+    def create_enhanced_pdf_from_pages(self, original_pdf_path: str, pages_ocr_results: Iterable[Dict], output_path: str):
+        """從頁面 OCR 結果創建增強的 PDF"""
+        self._write_enhanced_pdf(
+            original_pdf_path, output_path,
+            lambda doc, fonts: self._annotate_pages(doc, pages_ocr_results, fonts)
+        )
+    
+    def create_enhanced_pdf_combined(self, original_pdf_path: str, images_descriptions: Iterable[Dict],
+                                     pages_ocr_results: Iterable[Dict], output_path: str):
+        """將圖片模式與頁面模式的結果寫入同一份增強 PDF（自動模式逐頁選擇時使用）"""
+        def annotate(doc, fonts):
+            self._annotate_images(doc, images_descriptions, fonts)
+            self._annotate_pages(doc, pages_ocr_results, fonts)
         
-        for img_desc in images_descriptions:
-            page_num = img_desc['page_num']
+        self._write_enhanced_pdf(original_pdf_path, output_path, annotate)
+    
+    def _write_enhanced_pdf(self, original_pdf_path: str, output_path: str, annotate):
+        """
+        開啟文件、寫入註解並保存
+        
+        註解來源是串流的 VLM 結果，寫入途中可能失敗；失敗時關閉文件並刪除增量模式的暫存副本，
+        輸出路徑不會留下看似完成的文件
+        """
+        doc, work_path = self._open_for_annotation(original_pdf_path, output_path)
+        try:
+            fonts = font_manager.document_writer(doc)
+            annotate(doc, fonts)
+            self._save_enhanced_pdf(doc, fonts, original_pdf_path, output_path, work_path)
+        finally:
+            if not doc.is_closed:
+                doc.close()
+            if work_path is not None and os.path.exists(work_path):
+                os.remove(work_path)
+    
+    def _open_for_annotation(self, original_pdf_path: str, output_path: str):
+        """
+        開啟要寫入註解的文件
+        
+        增量模式先將原始文件複製到輸出旁的暫存檔並開啟該副本，
+        保存時只附加變更的物件，不重寫原本的圖片串流；成功保存後才取代輸出文件
+        
+        Returns:
+            (文件, 增量模式的暫存檔路徑；完整保存時為 None)
+        """
+        if self.save_mode != "incremental":
+            return fitz.open(original_pdf_path), None
+        
+        work_path = f"{output_path}.{os.getpid()}.tmp"
+        shutil.copyfile(original_pdf_path, work_path)
+        doc = fitz.open(work_path)
+        if doc.can_save_incrementally():
+            return doc, work_path
+        
+        # 文件開啟時需要修復（或其他原因）無法增量保存時，改為完整保存
+        logger.warning(f"{original_pdf_path} 無法增量保存，改為完整保存")
+        doc.close()
+        os.remove(work_path)
+        return fitz.open(original_pdf_path), None
+    
+    def _save_enhanced_pdf(self, doc, fonts, original_pdf_path: str, output_path: str, work_path: Optional[str]):
+        """子集化嵌入字體後保存，並記錄原始與輸出的文件大小"""
+        fonts.subset()
+        incremental = work_path is not None
+        
+        if incremental:
+            # 增量保存不能回收物件；新寫入的字體與文字串流以 deflate 壓縮
+            doc.save(work_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate=self.save_deflate)
+            doc.close()
+            os.replace(work_path, output_path)
+        else:
+            # subset_fonts 直接取代原本的字體串流，不留下未引用的物件，預設不需要 garbage 回收；
+            # 較高的等級會比對所有物件去除重複，大型文件的保存時間明顯增加
+            doc.save(output_path, garbage=self.save_garbage, deflate=self.save_deflate)
+            doc.close()
+        
+        original_size = os.path.getsize(original_pdf_path)
+        output_size = os.path.getsize(output_path)
+        logger.info(f"增強的 PDF 已保存到: {output_path}（{'增量' if incremental else '完整'}保存，"
+                    f"原始 {original_size} 字節 → 輸出 {output_size} 字節）")
+    
+    def _annotate_images(self, doc, images_descriptions: Iterable[Dict], fonts):
+        """
+        將圖片的描述與文字按頁合併後寫入，每頁只排版一次
+        
+        結果依頁碼順序串流產出，只需暫存目前頁面的結果；
+        頁面上的圖片數量不影響排版次數
+        """
+        for page_num, page_descriptions in self._group_by_page(images_descriptions):
             page = doc[page_num]
-            rect = img_desc['rect']
-            description = img_desc['description']
-            ocr_text = img_desc.get('ocr_text', '')
             
             # 從左上角開始放置文字，使用較小的字體，擴大文字區域
             page_rect = page.rect
@@ -185,33 +449,54 @@ class PDFProcessor:
                 page_rect.y1 - 10   # 使用整個頁面高度，底部留 10 像素邊距
             )
             
-            # 添加描述文字
-            full_text = f"圖片描述: {description}"
-            if ocr_text:
-                full_text += f"\n文字內容: {ocr_text}"
+            # 添加描述文字；同一頁有多張圖片時依序編號，相同圖片（或相同結果）的位置合併為一段
+            groups = {}
+            for index, img_desc in enumerate(page_descriptions):
+                key = img_desc.get('image_hash') or (img_desc['description'], img_desc.get('ocr_text', ''))
+                groups.setdefault(key, (img_desc, []))[1].append(index + 1)
+            
+            sections = []
+            for img_desc, numbers in groups.values():
+                section = f"圖片描述: {img_desc['description']}"
+                if img_desc.get('ocr_text', ''):
+                    section += f"\n文字內容: {img_desc['ocr_text']}"
+                if len(page_descriptions) > 1:
+                    section = f"[圖片 {','.join(map(str, numbers))}] {section}"
+                sections.append(section)
             
-            # 使用字體管理器插入文字，使用較小字體
-            font_manager.insert_text_with_font(
+            # 以文件共用的字體插入文字，使用較小字體
+            fonts.insert_text(
                 page,
                 text_rect,
-                full_text,
+                "\n\n".join(sections),
                 fontsize=6,  # 從 8 改為 6，字體更小
                 color=(0, 0, 1)  # 藍色
             )
-        
-        doc.save(output_path)
-        doc.close()
-        logger.info(f"增強的 PDF 已保存到: {output_path}")
     
-    def create_enhanced_pdf_from_pages(self, original_pdf_path: str, pages_ocr_results: List[Dict], output_path: str):
-        """從頁面 OCR 結果創建增強的 PDF"""
-        doc = fitz.open(original_pdf_path)
-        
+    @staticmethod
+    def _group_by_page(images_descriptions: Iterable[Dict]) -> Iterator[Tuple[int, List[Dict]]]:
+        """將連續屬於同一頁的結果分為一組，預過濾略過的圖片只記錄在結果中，不寫入註解"""
+        current_page = None
+        group = []
+        for img_desc in images_descriptions:
+            if img_desc.get('skipped'):
+                continue
+            if img_desc['page_num'] != current_page and group:
+                yield current_page, group
+                group = []
+            current_page = img_desc['page_num']
+            group.append(img_desc)
+        if group:
+            yield current_page, group
+    
+    def _annotate_pages(self, doc, pages_ocr_results: Iterable[Dict], fonts):
+        """將每頁的 OCR 結果寫入該頁"""
         for page_result in pages_ocr_results:
             page_num = page_result['page_num']
             page = doc[page_num]
             ocr_text = page_result.get('ocr_text', '')
             
+            # 使用原生文字層的頁面 ocr_text 為空，文字已在 PDF 中，不重複寫入
             if ocr_text and ocr_text != "無文字內容":
                 # 從左上角開始添加 OCR 結果，使用整個頁面空間
                 print(f"新增頁面 {page_num+1} 的 OCR 結果: {ocr_text}")
@@ -223,8 +508,8 @@ class PDFProcessor:
                     page_rect.y1 - 10   # 使用整個頁面高度，底部留 10 像素邊距
                 )
                 
-                # 使用字體管理器插入文字，使用較小字體
-                success = font_manager.insert_text_with_font(
+                # 以文件共用的字體插入文字，使用較小字體
+                success = fonts.insert_text(
                     page,
                     text_rect,
                     f"頁面 OCR 結果: {ocr_text}",
@@ -247,8 +532,4 @@ class PDFProcessor:
                     except Exception as e:
                         print(f"直接插入文字也失敗: {str(e)}")
                 else:
-                    print(f"字體管理器插入文字成功")
-        
-        doc.save(output_path)
-        doc.close()
-        logger.info(f"增強的 PDF 已保存到: {output_path}")
\ No newline at end of file
+                    print(f"字體管理器插入文字成功")
\ No newline at end of file
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+PDF 多進程工作模組
+頁面層級的圖片提取與渲染邏輯，單進程與進程池共用同一份實作；
+子進程開啟各自的 fitz 文件，結果經由暫存檔或序列化字典傳回
+此模組只依賴 PyMuPDF 與 ImagePayload，讓子進程啟動時保持輕量
+"""
+
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+# 提取圖片時保留已解碼 xref 的數量上限
+XREF_CACHE_SIZE = 128
+
+def chunk_page_numbers(page_count: int, chunk_size: int, page_nums: Optional[Iterable[int]] = None) -> List[List[int]]:
+    """將頁碼範圍切分為連續的區塊；提供 page_nums 時只切分其中的頁碼"""
+    chunk_size = max(1, chunk_size)
+    page_nums = list(range(page_count)) if page_nums is None else sorted(page_nums)
+    return [page_nums[start:start + chunk_size] for start in range(0, len(page_nums), chunk_size)]
+
+def decode_xref_image(doc, xref: int, page_num: int, img_index: int) -> Optional[Tuple[ImagePayload, str]]:
+    """解碼單個 xref 圖片，返回 (ImagePayload, 內容雜湊)，無法使用時返回 None"""
+    pix = fitz.Pixmap(doc, xref)
+
+    try:
+        if pix.n - pix.alpha >= 4:  # 確保不是 CMYK
+            return None
+
+        # 由 PyMuPDF 編碼一次，之後不再重新解碼或編碼
+        payload = ImagePayload.from_pixmap(pix)
+
+    finally:
+        pix = None
+
+    # 直接在編碼後的字節上驗證圖片
+    error = payload.validate()
+    if error:
+        logger.warning(f"頁面 {page_num+1} 圖片 {img_index+1} 無效，跳過: {error}")
+        return None
+
+    # 以編碼後的內容計算雜湊，不同 xref 但像素相同的圖片也能被識別
+    image_hash = hashlib.sha1(payload.data).hexdigest()
+    return payload, image_hash
+
+def iter_page_images(doc, page_num: int, decoded_xrefs: OrderedDict) -> Iterator[Dict]:
+    """
+    產出單頁中每個圖片位置的信息
+
+    decoded_xrefs 為呼叫端持有的 LRU 快取，同一 xref 在多個頁面重複引用時只解碼一次
+    """
+    page = doc[page_num]
+    image_list = page.get_images()
+
+    for img_index, img in enumerate(image_list):
+        try:
+            # 獲取圖片數據
+            xref = img[0]
+
+            if xref in decoded_xrefs:
+                decoded_xrefs.move_to_end(xref)
+            else:
+                decoded_xrefs[xref] = decode_xref_image(doc, xref, page_num, img_index)
+                if len(decoded_xrefs) > XREF_CACHE_SIZE:
+                    decoded_xrefs.popitem(last=False)
+            decoded = decoded_xrefs[xref]
+            if decoded is None:
+                continue
+
+            payload, image_hash = decoded
+
+            # 獲取圖片在頁面中的位置
+            img_rects = page.get_image_rects(xref)
+
+        except Exception as e:
+            logger.error(f"處理頁面 {page_num+1} 圖片 {img_index+1} 時發生錯誤: {str(e)}")
+            continue
+
+        for rect in img_rects:
+            yield {
+                'page_num': page_num,
+                'image': payload,
+                'rect': rect,
+                'xref': xref,
+                'img_index': img_index,
+                'image_hash': image_hash
+            }
+
+def extract_page_range_images(pdf_path: str, page_nums: List[int]) -> List[Dict]:
+    """
+    在子進程中提取一段頁面的圖片
+
+    ImagePayload 與 fitz.Rect 轉為可序列化的基本型別傳回，
+    由 restore_extracted_image 在主進程還原；順序與單進程提取完全相同
+    """
+    doc = fitz.open(pdf_path)
+    decoded_xrefs = OrderedDict()
+    records = []
+
+    try:
+        for page_num in page_nums:
+            for img_info in iter_page_images(doc, page_num, decoded_xrefs):
+                payload = img_info['image']
+                width, height = payload.size
+                records.append({
+                    'page_num': img_info['page_num'],
+                    'img_index': img_info['img_index'],
+                    'xref': img_info['xref'],
+                    'rect': tuple(img_info['rect']),
+                    'image_hash': img_info['image_hash'],
+                    'data': payload.data,
+                    'width': width,
+                    'height': height,
+                    'mode': payload.mode
+                })
+    finally:
+        doc.close()
+
+    return records
+
+def restore_extracted_image(record: Dict, payloads: Dict[str, ImagePayload]) -> Dict:
+    """
+    將子進程傳回的記錄還原為與單進程相同格式的圖片信息
+
+    payloads 以內容雜湊共用 ImagePayload，相同圖片在主進程只保留一份
+    """
+    payload = payloads.get(record['image_hash'])
+    if payload is None:
+        payload = ImagePayload(record['data'], "image/png", record['width'], record['height'], record['mode'])
+        payloads[record['image_hash']] = payload
+
+    return {
+        'page_num': record['page_num'],
+        'image': payload,
+        'rect': fitz.Rect(record['rect']),
+        'xref': record['xref'],
+        'img_index': record['img_index'],
+        'image_hash': record['image_hash']
+    }
+
+def render_page_range(pdf_path: str, dpi: int, out_dir: str, page_nums: List[int]) -> List[Dict]:
+    """
+    在子進程中渲染一段頁面並將 PNG 寫入暫存資料夾
+
+    Returns:
+        每頁一項，包含 page_num、path、width、height、mode
+    """
+    doc = fitz.open(pdf_path)
+    zoom = dpi / 72  # 72 是 PDF 的默認 DPI
+    mat = fitz.Matrix(zoom, zoom)
+    results = []
+
+    try:
+        for page_num in page_nums:
+            pix = doc[page_num].get_pixmap(matrix=mat)
+            payload = ImagePayload.from_pixmap(pix)
+            pix = None
+
+            path = Path(out_dir) / f"page_{page_num+1:05d}.png"
+            path.write_bytes(payload.data)
+
+            width, height = payload.size
+            results.append({
+                'page_num': page_num,
+                'path': str(path),
+                'width': width,
+                'height': height,
+                'mode': payload.mode
+            })
+    finally:
+        doc.close()
+
+    return results
+
+def load_rendered_page(result: Dict, keep_path: Path = None) -> ImagePayload:
+    """讀回子進程渲染的頁面；提供 keep_path 時把暫存檔移到該處，否則刪除"""
+    data = Path(result['path']).read_bytes()
+    if keep_path is not None:
+        try:
+            os.replace(result['path'], keep_path)
+        except OSError:
+            # 暫存資料夾與目標位於不同檔案系統時改為直接寫入
+            Path(keep_path).write_bytes(data)
+            os.remove(result['path'])
+    else:
+        os.remove(result['path'])
+    return ImagePayload(data, "image/png", result['width'], result['height'], result['mode'])
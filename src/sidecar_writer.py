@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+結構化結果輸出模組
+在增強 PDF 旁逐筆寫出每張圖片或每頁的結果（JSONL，可選 Parquet），下游不需要再解析 PDF
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 為可選功能
+    pa = None
+    pq = None
+
+# 每筆記錄的欄位，JSONL 與 Parquet 共用
+SIDECAR_FIELDS = [
+    "document", "kind", "page_num", "rect", "xref", "image_hash", "description", "ocr_text",
+    "native_text", "source", "skipped", "duplicate", "cached", "resumed", "elapsed_ms", "tiles",
+]
+
+def _parquet_schema():
+    return pa.schema([
+        ("document", pa.string()),
+        ("kind", pa.string()),
+        ("page_num", pa.int32()),
+        ("rect", pa.list_(pa.float64())),
+        ("xref", pa.int64()),
+        ("image_hash", pa.string()),
+        ("description", pa.string()),
+        ("ocr_text", pa.string()),
+        ("native_text", pa.string()),
+        ("source", pa.string()),
+        ("skipped", pa.string()),
+        ("duplicate", pa.bool_()),
+        ("cached", pa.bool_()),
+        ("resumed", pa.bool_()),
+        ("elapsed_ms", pa.float64()),
+        ("tiles", pa.int32()),
+    ])
+
+class SidecarWriter:
+    """
+    逐筆寫出結構化結果
+
+    JSONL 每筆立即寫入；Parquet 累積 batch_size 筆後寫成一個 row group，記憶體用量固定
+    """
+
+    def __init__(self, output_pdf_path: str, document: str, formats: Iterable[str] = ("jsonl",),
+                 batch_size: int = 500):
+        output_pdf_path = Path(output_pdf_path)
+        self.document = document
+        self.batch_size = batch_size
+        self.records = 0
+        self.paths = []
+
+        formats = {fmt.strip().lower() for fmt in formats if fmt.strip()}
+        unknown = formats - {"jsonl", "parquet"}
+        if unknown:
+            logger.warning(f"不支援的結果輸出格式: {', '.join(sorted(unknown))}")
+
+        self._jsonl = None
+        if "jsonl" in formats:
+            path = output_pdf_path.with_suffix(".jsonl")
+            self._jsonl = open(path, "w", encoding="utf-8")
+            self.paths.append(str(path))
+
+        self._parquet = None
+        self._batch: List[Dict] = []
+        if "parquet" in formats:
+            if pq is None:
+                logger.warning("未安裝 pyarrow，略過 Parquet 輸出")
+            else:
+                path = output_pdf_path.with_suffix(".parquet")
+                self._parquet = pq.ParquetWriter(str(path), _parquet_schema())
+                self.paths.append(str(path))
+
+    @property
+    def enabled(self) -> bool:
+        return self._jsonl is not None or self._parquet is not None
+
+    def write(self, kind: str, page_num: int, **fields):
+        """寫出一筆結果；kind 為 "image" 或 "page"，未提供的欄位為 None"""
+        if not self.enabled:
+            return
+
+        record = dict.fromkeys(SIDECAR_FIELDS)
+        record.update(fields)
+        record["document"] = self.document
+        record["kind"] = kind
+        record["page_num"] = page_num
+        if record["rect"] is not None:
+            record["rect"] = [round(float(v), 2) for v in record["rect"]]
+        if record["elapsed_ms"] is not None:
+            record["elapsed_ms"] = round(record["elapsed_ms"], 1)
+
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._jsonl.flush()
+
+        if self._parquet is not None:
+            self._batch.append(record)
+            if len(self._batch) >= self.batch_size:
+                self._flush_parquet()
+
+        self.records += 1
+
+    def _flush_parquet(self):
+        if self._batch:
+            self._parquet.write_table(pa.Table.from_pylist(self._batch, schema=_parquet_schema()))
+            self._batch = []
+
+    def close(self):
+        """寫出剩餘的記錄並關閉檔案"""
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+        if self._parquet is not None:
+            self._flush_parquet()
+            self._parquet.close()
+            self._parquet = None
+        if self.paths:
+            logger.info(f"結構化結果已寫出 {self.records} 筆: {', '.join(self.paths)}")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+原生文字層偵測模組
+頁面已有可提取的文字層時直接使用 page.get_text，只有缺少文字的頁面或圖片區域才送交 VLM
+"""
+
+import os
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# 文字來源
+SOURCE_NATIVE = "native"  # 完全使用原生文字層
+SOURCE_HYBRID = "hybrid"  # 原生文字層 + 圖片區域的 VLM OCR
+SOURCE_VLM = "vlm"        # 整頁 VLM OCR
+
+class TextLayerAnalyzer:
+    """逐頁測量原生文字層的覆蓋率，決定每頁的文字來源"""
+
+    def __init__(self, min_chars: int = None, max_garbled_ratio: float = None,
+                 max_image_coverage: float = None, full_page_region: float = None, min_region_area: float = 100):
+        if min_chars is None:
+            min_chars = int(os.getenv("TEXT_LAYER_MIN_CHARS", "20"))
+        if max_garbled_ratio is None:
+            max_garbled_ratio = float(os.getenv("TEXT_LAYER_MAX_GARBLED", "0.1"))
+        if max_image_coverage is None:
+            max_image_coverage = float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.05"))
+        if full_page_region is None:
+            full_page_region = float(os.getenv("TEXT_LAYER_FULL_PAGE_REGION", "0.8"))
+
+        self.min_chars = min_chars                    # 少於此字數視為沒有文字層
+        self.max_garbled_ratio = max_garbled_ratio    # 無法對應字元（U+FFFD）的比例上限，超過視為文字層損壞
+        self.max_image_coverage = max_image_coverage  # 圖片覆蓋頁面比例低於此值時不另外 OCR
+        self.full_page_region = full_page_region      # 需要 OCR 的區域超過此比例時改為整頁 OCR
+        self.min_region_area = min_region_area        # 小於此面積的圖片位置不計入（點²）
+
+    def analyze_page(self, page) -> Dict:
+        """
+        分析單頁的文字層
+
+        Returns:
+            包含 source、native_text、region（需要 OCR 的區域，fitz.Rect 或 None）、
+            text_chars、text_coverage 與 image_coverage 的字典
+        """
+        page_rect = page.rect
+        page_area = page_rect.width * page_rect.height or 1.0
+
+        native_text = page.get_text("text", sort=True).strip()
+        text_chars = sum(1 for ch in native_text if not ch.isspace())
+        garbled = native_text.count("\ufffd")
+
+        text_area = 0.0
+        for block in page.get_text("blocks"):
+            if block[6] == 0:  # 文字區塊
+                text_area += (fitz.Rect(block[:4]) & page_rect).get_area()
+
+        # 文字層沒有涵蓋的內容主要來自圖片，取所有圖片位置的外框作為 OCR 區域
+        region = None
+        image_area = 0.0
+        for img in page.get_images():
+            for rect in page.get_image_rects(img[0]):
+                rect = rect & page_rect
+                if rect.is_empty or rect.get_area() < self.min_region_area:
+                    continue
+                image_area += rect.get_area()
+                region = rect if region is None else region | rect
+
+        has_text = text_chars >= self.min_chars and garbled <= text_chars * self.max_garbled_ratio
+        image_coverage = min(1.0, image_area / page_area)
+
+        if not has_text:
+            source = SOURCE_VLM
+        elif region is None or image_coverage < self.max_image_coverage:
+            source = SOURCE_NATIVE
+        elif region.get_area() / page_area >= self.full_page_region:
+            source = SOURCE_VLM
+        else:
+            source = SOURCE_HYBRID
+
+        return {
+            'page_num': page.number,
+            'source': source,
+            'native_text': native_text if has_text else "",
+            'region': region if source == SOURCE_HYBRID else None,
+            'text_chars': text_chars,
+            'text_coverage': round(min(1.0, text_area / page_area), 4),
+            'image_coverage': round(image_coverage, 4)
+        }
+
+    def analyze_document(self, pdf_path: str, page_nums: Optional[Iterable[int]] = None) -> List[Dict]:
+        """分析文件中的每一頁（或指定的頁面），只讀取文字與圖片位置，不渲染"""
+        doc = fitz.open(pdf_path)
+        try:
+            pages = range(len(doc)) if page_nums is None else sorted(page_nums)
+            return [self.analyze_page(doc[page_num]) for page_num in pages]
+        finally:
+            doc.close()
+
+    @staticmethod
+    def summarize(analyses: List[Dict]) -> Dict[str, int]:
+        """統計各文字來源的頁數"""
+        counts = {SOURCE_NATIVE: 0, SOURCE_HYBRID: 0, SOURCE_VLM: 0}
+        for analysis in analyses:
+            counts[analysis['source']] += 1
+        return counts
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+VLM 結果快取模組
+以圖片內容與請求參數為鍵，將 VLM 分析結果持久化到 SQLite
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class VLMResultCache:
+    """以內容定址、大小受限並採用 LRU 淘汰的 VLM 結果快取"""
+
+    def __init__(self, db_path: str = "./temp/vlm_cache.sqlite", max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("VLM_CACHE_MAX_MB", "512")) * 1024 * 1024
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        # 排程器的多個工作執行緒共用同一連線，以鎖保護
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS vlm_results (
+                key TEXT PRIMARY KEY,
+                prompt_type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_vlm_results_last_access ON vlm_results(last_access)"
+        )
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM vlm_results").fetchone()
+        self._total_bytes = row[0]
+        logger.info(f"VLM 結果快取: {db_path}（目前 {self._total_bytes} 字節，上限 {self.max_bytes} 字節）")
+
+    @staticmethod
+    def make_key(image_base64: str, prompt_type: str, model: str, params: Dict) -> str:
+        """根據圖片內容、分析類型、模型名稱與生成參數計算快取鍵"""
+        digest = hashlib.sha256()
+        digest.update(image_base64.encode("ascii"))
+        digest.update(b"\0")
+        digest.update(prompt_type.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """讀取快取內容，未命中或資料庫無法存取（例如其他進程鎖定）時返回 None"""
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT content FROM vlm_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+
+                self.hits += 1
+                self._conn.execute(
+                    "UPDATE vlm_results SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+                self._conn.commit()
+                return row[0]
+            except sqlite3.Error as e:
+                logger.warning(f"讀取 VLM 結果快取失敗，視為未命中: {str(e)}")
+                self.misses += 1
+                return None
+
+    def put(self, key: str, prompt_type: str, content: str):
+        """寫入快取，超過大小上限時淘汰最久未使用的項目"""
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            total_bytes = self._total_bytes
+            evictions = self.evictions
+            try:
+                old = self._conn.execute(
+                    "SELECT size FROM vlm_results WHERE key = ?", (key,)
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO vlm_results (key, prompt_type, content, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, prompt_type, content, size, now, now)
+                )
+                self._total_bytes += size - (old[0] if old else 0)
+                self._evict_locked()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                # 寫入失敗不影響分析結果，回復交易與計數後略過
+                logger.warning(f"寫入 VLM 結果快取失敗，略過: {str(e)}")
+                self._conn.rollback()
+                self._total_bytes = total_bytes
+                self.evictions = evictions
+
+    def discard(self, key: str):
+        """移除單一項目（例如內容已確認無法使用時）"""
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT size FROM vlm_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return
+                self._conn.execute("DELETE FROM vlm_results WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total_bytes -= row[0]
+            except sqlite3.Error as e:
+                logger.warning(f"移除 VLM 結果快取項目失敗: {str(e)}")
+                self._conn.rollback()
+
+    def _evict_locked(self):
+        """依 last_access 由舊到新淘汰，直到總大小回到上限內"""
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM vlm_results ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+
+            for key, size in rows:
+                self._conn.execute("DELETE FROM vlm_results WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict:
+        """返回快取命中統計"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "total_bytes": self._total_bytes,
+            }
+
+    def close(self):
+        """關閉資料庫連線"""
+        with self._lock:
+            self._conn.close()
@@ -1,49 +1,85 @@
 # -*- coding: utf-8 -*-
+import os
+import re
+import time
+import random
+import threading
 import requests
-import base64
+from requests.adapters import HTTPAdapter
 import json
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 import logging
+from vlm_cache import VLMResultCache
+from image_payload import ImagePayload
+from endpoint_pool import EndpointPool
 
 logger = logging.getLogger(__name__)
 
-class QwenVLMClient:
-    def __init__(self, api_url: str = "http://localhost:8000"):
-        self.api_url = api_url
+# 視為暫時性錯誤、可以重試的 HTTP 狀態碼
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def iter_sse_data(response: requests.Response) -> Iterator[str]:
+    """逐一產出 Server-Sent Events 中 data: 欄位的內容"""
+    for line in response.iter_lines(decode_unicode=False):
+        if not line or not line.startswith(b"data:"):
+            continue
+        yield line[5:].strip().decode("utf-8")
+
+class BaseVLMClient:
+    """
+    同步與非同步 VLM 客戶端共用的部分：提示詞、請求內容、快取、回應解析與統計
+    
+    子類別只需實作實際送出 HTTP 請求的方式
+    """
+    
+    def __init__(self, api_url: Union[str, List[str]] = "http://localhost:8000", cache: Optional[VLMResultCache] = None):
+        # 可傳入多個端點（列表或逗號分隔），請求分配到在途請求最少的健康端點
+        self.endpoints = EndpointPool(api_url)
+        self.api_url = self.endpoints.urls[0]
+        self.model = "Qwen/Qwen2.5-VL-32B-Instruct"
+        self.temperature = 0.1
+        # 單次請求的生成上限；合併模式需同時輸出描述與文字，使用兩倍額度
+        self.max_tokens = int(os.getenv("VLM_MAX_TOKENS", "1000"))
+        self.cache = cache
         self.headers = {
             "Content-Type": "application/json"
         }
-    
-    def analyze_image(self, image_base64: str, prompt_type: str = "description") -> Dict[str, str]:
-        """
-        使用 Qwen2.5-VL 分析圖片
         
-        Args:
-            image_base64: base64 編碼的圖片
-            prompt_type: 分析類型 ("description" 或 "ocr")
-        
-        Returns:
-            包含分析結果的字典
-        """
-        
-        # 驗證 base64 圖片數據
-        if not image_base64 or not image_base64.strip():
-            logger.error("收到空的 base64 圖片數據")
-            return {"success": False, "error": "圖片數據為空"}
-        
-        # 驗證 base64 數據格式
-        try:
-            # 嘗試解碼 base64 以驗證格式
-            import base64 as b64
-            decoded_data = b64.b64decode(image_base64)
-            logger.info(f"圖片數據大小: {len(decoded_data)} 字節")
-            if len(decoded_data) < 20:  # 只有極小的數據才拒絕
-                logger.error(f"圖片數據太小: {len(decoded_data)} 字節，可能無效")
-                return {"success": False, "error": "圖片數據太小，可能無效"}
-        except Exception as e:
-            logger.error(f"無效的 base64 數據: {str(e)}")
-            return {"success": False, "error": "無效的 base64 圖片數據"}
+        # 連線與讀取逾時分開設定，連線失敗可以很快重試
+        self.connect_timeout = float(os.getenv("VLM_CONNECT_TIMEOUT", "10"))
+        self.read_timeout = float(os.getenv("VLM_READ_TIMEOUT", "120"))
+        self.max_retries = int(os.getenv("VLM_MAX_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("VLM_RETRY_BACKOFF", "1.0"))
         
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+        }
+    
+    def _count(self, name: str):
+        """累加請求統計"""
+        with self._metrics_lock:
+            self._metrics[name] += 1
+    
+    def metrics(self) -> Dict:
+        """返回請求、重試與失敗次數；多端點時另含各端點的統計"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        if len(self.endpoints) > 1:
+            metrics["endpoints"] = self.endpoints.stats()
+        return metrics
+    
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """計算第 attempt 次重試前的等待秒數（指數退避加隨機抖動，並遵守 Retry-After）"""
+        delay = self.retry_backoff * (2 ** attempt)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay + random.uniform(0, self.retry_backoff)
+    
+    def _build_prompts(self, prompt_type: str):
+        """根據分析類型返回 (system_prompt, user_prompt)"""
         if prompt_type == "description":
             system_prompt = """你是一個專業的圖片分析助手。請詳細描述這張圖片的內容，包括：
 1. 主要物體和場景
@@ -68,12 +104,86 @@ class QwenVLMClient:
             
             user_prompt = "請提取這張圖片中的所有文字內容。"
         
+        elif prompt_type == "combined":
+            system_prompt = """你是一個專業的圖片分析與 OCR 助手。請同時完成兩項工作：
+1. 詳細描述這張圖片的內容（主要物體和場景、顏色和構圖、重要細節、整體主題或用途）
+2. 識別並提取圖片中的所有文字內容，保持原始的格式和結構
+
+請用繁體中文回答，並且只輸出以下格式的 JSON，不要輸出任何其他內容：
+{"description": "圖片描述", "ocr_text": "圖片中的文字"}
+
+如果圖片中沒有文字，ocr_text 請填「無文字內容」。
+"""
+            
+            user_prompt = "請描述這張圖片並提取其中的所有文字，以 JSON 格式輸出。"
+        
         else:
             system_prompt = "請分析這張圖片並提供相關信息。"
             user_prompt = "請分析這張圖片。"
         
+        return system_prompt, user_prompt
+    
+    def _prepare_request(self, image_base64: Union[str, ImagePayload], prompt_type: str,
+                         use_cache: bool) -> Tuple[Optional[Dict], Optional[Dict], Optional[str]]:
+        """
+        驗證圖片、查詢快取並建立 chat completion 請求內容
+        
+        Returns:
+            (提前返回的結果, 請求內容, 快取鍵)；圖片無效或快取命中時第一項不為 None
+        """
+        mime = "image/png"
+        
+        # ImagePayload 直接在原始字節上驗證，再使用快取的 base64 字串
+        if isinstance(image_base64, ImagePayload):
+            payload = image_base64
+            error = payload.validate()
+            if error:
+                logger.error(f"圖片數據無效: {error}")
+                return {"success": False, "error": error}, None, None
+            mime = payload.mime
+            image_base64 = payload.to_base64()
+        
+        # 驗證 base64 圖片數據
+        if not image_base64 or image_base64.isspace():
+            logger.error("收到空的 base64 圖片數據")
+            return {"success": False, "error": "圖片數據為空"}, None, None
+        
+        # 驗證 base64 數據格式，直接由字串長度推算圖片大小，不需整段解碼
+        if len(image_base64) % 4 != 0:
+            logger.error("無效的 base64 數據: 長度不是 4 的倍數")
+            return {"success": False, "error": "無效的 base64 圖片數據"}, None, None
+        
+        padding = 2 if image_base64.endswith("==") else 1 if image_base64.endswith("=") else 0
+        decoded_size = len(image_base64) // 4 * 3 - padding
+        logger.info(f"圖片數據大小: {decoded_size} 字節")
+        if decoded_size < 20:  # 只有極小的數據才拒絕
+            logger.error(f"圖片數據太小: {decoded_size} 字節，可能無效")
+            return {"success": False, "error": "圖片數據太小，可能無效"}, None, None
+        
+        system_prompt, user_prompt = self._build_prompts(prompt_type)
+        
+        # 合併模式需同時輸出描述與文字，給予較多的生成額度
+        max_tokens = self.max_tokens * 2 if prompt_type == "combined" else self.max_tokens
+        
+        # 先查詢快取，相同圖片與參數不重複送出請求
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(
+                image_base64,
+                prompt_type,
+                self.model,
+                {"max_tokens": max_tokens, "temperature": self.temperature, "system_prompt": system_prompt, "user_prompt": user_prompt}
+            )
+            cached_content = self.cache.get(cache_key)
+            if cached_content is not None:
+                logger.info(f"VLM 快取命中 ({prompt_type})")
+                result = {"success": True, "content": cached_content, "cached": True}
+                if prompt_type == "combined":
+                    result["cache_key"] = cache_key
+                return result, None, None
+        
         payload = {
-            "model": "Qwen/Qwen2.5-VL-32B-Instruct",
+            "model": self.model,
             "messages": [
                 {
                     "role": "system",
@@ -89,28 +199,219 @@ class QwenVLMClient:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{image_base64}"
+                                "url": f"data:{mime};base64,{image_base64}"
                             }
                         }
                     ]
                 }
             ],
-            "max_tokens": 1000,
-            "temperature": 0.1
+            "max_tokens": max_tokens,
+            "temperature": self.temperature
         }
         
+        return None, payload, cache_key
+    
+    def _handle_completion(self, result: Dict, prompt_type: str, cache_key: Optional[str]) -> Dict:
+        """
+        從成功的 chat completion 回應取出內容並寫入快取
+
+        合併模式的回應要先能解析才寫入，否則無法解析的內容會在之後每次執行時重播；
+        此時返回 cache_key，由 _parse_combined_result 在解析成功後寫入
+        """
+        content = result['choices'][0]['message']['content']
+        if cache_key is not None and prompt_type == "combined":
+            return {"success": True, "content": content, "cached": False, "cache_key": cache_key}
+        if cache_key is not None:
+            self.cache.put(cache_key, prompt_type, content)
+        return {"success": True, "content": content, "cached": False}
+    
+    @staticmethod
+    def _parse_combined_response(content: str) -> Optional[Dict[str, str]]:
+        """
+        解析合併模式的 JSON 回應
+        
+        模型偶爾會加上 ```json 區塊、前後說明文字或使用其他鍵名，
+        這裡盡量寬鬆地取出描述與文字；無法解析時返回 None
+        """
+        if not content or not content.strip():
+            return None
+        
+        text = content.strip()
+        
+        # 移除 markdown 程式碼區塊標記
+        fence = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+        if fence:
+            text = fence.group(1).strip()
+        
+        # 取出第一個 { 到最後一個 } 之間的內容
+        start = text.find("{")
+        end = text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        
         try:
-            response = requests.post(
-                f"{self.api_url}/v1/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=120
-            )
+            data = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            # 模型有時會在字串中直接輸出換行，改用寬鬆模式再試一次
+            try:
+                data = json.loads(text[start:end + 1], strict=False)
+            except json.JSONDecodeError:
+                return None
+        
+        if not isinstance(data, dict):
+            return None
+        
+        description = data.get("description", data.get("描述"))
+        ocr_text = data.get("ocr_text", data.get("ocr", data.get("文字內容")))
+        if description is None or ocr_text is None:
+            return None
+        
+        if isinstance(ocr_text, list):
+            ocr_text = "\n".join(str(line) for line in ocr_text)
+        
+        description = str(description).strip()
+        ocr_text = str(ocr_text).strip() or "無文字內容"
+        if not description:
+            return None
+        
+        return {"description": description, "ocr_text": ocr_text}
+    
+    @staticmethod
+    def _use_combined_mode(combined: Optional[bool]) -> bool:
+        """未指定時讀取 VLM_COMBINED_MODE"""
+        if combined is None:
+            combined = os.getenv("VLM_COMBINED_MODE", "true").lower() == "true"
+        return combined
+    
+    def _parse_combined_result(self, combined_result: Dict) -> Optional[Dict[str, str]]:
+        """
+        解析合併模式的請求結果，失敗時記錄原因並返回 None 以改用兩次請求
+
+        解析成功的新回應才寫入快取；快取中無法解析的舊項目會被移除
+        """
+        if combined_result["success"]:
+            content = combined_result.get("content", "")
+            cache_key = combined_result.get("cache_key")
+            cached = combined_result.get("cached", False)
+            parsed = self._parse_combined_response(content)
+            if parsed is not None:
+                if cache_key is not None and not cached:
+                    self.cache.put(cache_key, "combined", content)
+                parsed["cached"] = cached
+                return parsed
+            if cache_key is not None and cached:
+                self.cache.discard(cache_key)
+            logger.warning("合併模式回應無法解析，改用描述與 OCR 分開請求")
+        else:
+            logger.warning(f"合併模式請求失敗，改用描述與 OCR 分開請求: {combined_result.get('error', '')}")
+        return None
+    
+    @staticmethod
+    def _merge_separate_results(desc_result: Dict, ocr_result: Dict) -> Dict[str, str]:
+        """合併描述與 OCR 兩次請求的結果；任一請求失敗時 failed 為 True"""
+        description = desc_result.get("content", "無法獲取描述") if desc_result["success"] else "描述分析失敗"
+        ocr_text = ocr_result.get("content", "無文字內容") if ocr_result["success"] else "OCR 分析失敗"
+        
+        return {
+            "description": description,
+            "ocr_text": ocr_text,
+            "cached": desc_result.get("cached", False) and ocr_result.get("cached", False),
+            "failed": not (desc_result["success"] and ocr_result["success"])
+        }
+
+class QwenVLMClient(BaseVLMClient):
+    def __init__(self, api_url: Union[str, List[str]] = "http://localhost:8000", cache: Optional[VLMResultCache] = None,
+                 pool_size: int = None):
+        super().__init__(api_url, cache)
+        
+        # 連線池大小與請求併發數一致，讓每個在途請求都能重用 keep-alive 連線
+        if pool_size is None:
+            pool_size = int(os.getenv("VLM_MAX_CONCURRENCY", "8"))
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=len(self.endpoints), pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # 串流模式下同一行連續重複此次數即停止生成（0 表示不檢查）
+        self.runaway_repeat = int(os.getenv("VLM_RUNAWAY_REPEAT", "20"))
+    
+    def close(self):
+        """關閉連線池"""
+        self.session.close()
+    
+    def _post_chat_completion(self, payload: Dict, stream: bool = False) -> requests.Response:
+        """
+        送出 chat completion 請求，遇到連線錯誤、逾時、429 或 5xx 時以指數退避重試
+        
+        stream 為 True 時不預先讀取回應內容，重試只發生在收到第一個字之前；
+        成功的串流回應仍佔用端點的在途計數，呼叫端讀完後須呼叫
+        self.endpoints.release(response.vlm_endpoint, ...)
+        
+        每次嘗試都重新選擇端點，失敗的請求會自然地改送到其他端點
+        
+        Returns:
+            最後一次收到的回應；所有嘗試都發生連線錯誤時拋出最後的例外
+        """
+        for attempt in range(self.max_retries + 1):
+            self._count("requests")
+            retry_after = None
+            endpoint = self.endpoints.acquire()
+            
+            try:
+                response = self.session.post(
+                    f"{endpoint}/v1/chat/completions",
+                    json=payload,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.endpoints.release(endpoint, success=False)
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                logger.warning(f"VLM 請求發生暫時性錯誤，準備重試 ({attempt+1}/{self.max_retries}): {endpoint}: {str(e)}")
+            else:
+                response.vlm_endpoint = endpoint
+                retryable = response.status_code in RETRYABLE_STATUS_CODES
+                if not (stream and response.status_code == 200):
+                    # 4xx 是請求本身的問題，不算端點故障
+                    self.endpoints.release(endpoint, success=not retryable)
+                if not retryable:
+                    if response.status_code != 200:
+                        self._count("failures")
+                    return response
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    return response
+                logger.warning(f"VLM 請求返回 {response.status_code}，準備重試 ({attempt+1}/{self.max_retries}): {endpoint}")
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+            
+            self._count("retries")
+            time.sleep(self._retry_delay(attempt, retry_after))
+    
+    def analyze_image(self, image_base64: Union[str, ImagePayload], prompt_type: str = "description", use_cache: bool = True) -> Dict[str, str]:
+        """
+        使用 Qwen2.5-VL 分析圖片
+        
+        Args:
+            image_base64: base64 編碼的圖片，或已編碼的 ImagePayload
+            prompt_type: 分析類型 ("description"、"ocr" 或 "combined")
+            use_cache: 是否使用結果快取（健康檢查等請求應略過快取）
+        
+        Returns:
+            包含分析結果的字典
+        """
+        early_result, payload, cache_key = self._prepare_request(image_base64, prompt_type, use_cache)
+        if early_result is not None:
+            return early_result
+        
+        try:
+            response = self._post_chat_completion(payload)
             
             if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                return {"success": True, "content": content}
+                return self._handle_completion(response.json(), prompt_type, cache_key)
             else:
                 logger.error(f"API 請求失敗: {response.status_code}, {response.text}")
                 return {"success": False, "error": f"API 錯誤: {response.status_code}"}
@@ -119,18 +420,189 @@ class QwenVLMClient:
             logger.error(f"VLM 分析失敗: {str(e)}")
             return {"success": False, "error": str(e)}
     
-    def get_image_description_and_ocr(self, image_base64: str) -> Dict[str, str]:
-        """獲取圖片描述和 OCR 結果"""
+    def stream_image(self, image_base64: Union[str, ImagePayload], prompt_type: str = "ocr",
+                     stats: Optional[Dict] = None, use_cache: bool = True) -> Iterator[str]:
+        """
+        以 SSE 串流分析圖片，逐段產出生成的文字
+        
+        Args:
+            image_base64: base64 編碼的圖片，或已編碼的 ImagePayload
+            prompt_type: 分析類型
+            stats: 若提供，串流結束（或提前關閉）後會填入 success、error、cached、
+                ttft（秒）、tokens、elapsed（秒）、tokens_per_sec、completed
+            use_cache: 是否使用結果快取；快取命中時一次產出完整內容
+        
+        呼叫端可以隨時停止迭代，連線會被關閉，伺服器端的生成也隨之中止；
+        只有完整結束的串流才會寫入快取
+        """
+        if stats is None:
+            stats = {}
+        stats.update({
+            "success": False, "error": None, "cached": False, "completed": False,
+            "ttft": None, "tokens": 0, "elapsed": 0.0, "tokens_per_sec": 0.0
+        })
+        
+        early_result, payload, cache_key = self._prepare_request(image_base64, prompt_type, use_cache)
+        if early_result is not None:
+            stats["success"] = early_result["success"]
+            stats["error"] = early_result.get("error")
+            if early_result.get("cached"):
+                stats["cached"] = True
+                stats["completed"] = True
+                yield early_result["content"]
+            return
+        
+        payload = dict(payload, stream=True, stream_options={"include_usage": True})
+        start = time.perf_counter()
+        
+        try:
+            response = self._post_chat_completion(payload, stream=True)
+        except Exception as e:
+            logger.error(f"VLM 串流請求失敗: {str(e)}")
+            stats["error"] = str(e)
+            return
+        
+        if response.status_code != 200:
+            logger.error(f"API 請求失敗: {response.status_code}, {response.text}")
+            stats["error"] = f"API 錯誤: {response.status_code}"
+            response.close()
+            return
+        
+        chunks = []
+        usage_tokens = None
+        stats["success"] = True
+        
+        try:
+            for data in iter_sse_data(response):
+                if data == "[DONE]":
+                    stats["completed"] = True
+                    break
+                
+                event = json.loads(data)
+                if event.get("usage"):
+                    usage_tokens = event["usage"].get("completion_tokens", usage_tokens)
+                
+                for choice in event.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        if stats["ttft"] is None:
+                            stats["ttft"] = time.perf_counter() - start
+                        chunks.append(delta)
+                        yield delta
+        except Exception as e:
+            logger.error(f"VLM 串流讀取失敗: {str(e)}")
+            stats["success"] = False
+            stats["error"] = str(e)
+        finally:
+            response.close()
+            self.endpoints.release(response.vlm_endpoint, success=stats["success"])
+            
+            # vLLM 每個串流事件約為一個 token，伺服器沒有回報用量時以事件數估計
+            stats["tokens"] = usage_tokens if usage_tokens is not None else len(chunks)
+            stats["elapsed"] = time.perf_counter() - start
+            generation_time = stats["elapsed"] - (stats["ttft"] or 0.0)
+            if generation_time > 0:
+                stats["tokens_per_sec"] = stats["tokens"] / generation_time
+            
+            if stats["completed"] and cache_key is not None:
+                self.cache.put(cache_key, prompt_type, "".join(chunks))
+    
+    def analyze_image_streaming(self, image_base64: Union[str, ImagePayload], prompt_type: str = "ocr",
+                                stop_sentinel: Optional[str] = None, on_delta: Optional[Callable[[str], None]] = None,
+                                use_cache: bool = True) -> Dict:
+        """
+        以串流方式分析圖片，可提前停止
+        
+        Args:
+            stop_sentinel: 回應以此字串開頭時立即停止（例如「無文字內容」）
+            on_delta: 每收到一段文字就呼叫，可用於下游的即時處理
+        
+        Returns:
+            與 analyze_image 相同格式的字典，另含 stream_stats（TTFT、tokens/sec 等）
+            以及 stopped（"sentinel"、"runaway" 或 None）；串流中斷時 success 為 False，
+            已收到的內容放在 stream_stats["partial_content"]
+        """
+        stats = {}
+        chunks = []
+        stopped = None
+        sentinel_checked = stop_sentinel is None
+        stream = self.stream_image(image_base64, prompt_type, stats, use_cache)
+        
+        try:
+            for delta in stream:
+                chunks.append(delta)
+                if on_delta is not None:
+                    on_delta(delta)
+                
+                # 只在開頭判斷哨兵字串，足夠長之後不再檢查
+                if not sentinel_checked:
+                    head = "".join(chunks).lstrip()
+                    if head.startswith(stop_sentinel):
+                        stopped = "sentinel"
+                        break
+                    if len(head) >= len(stop_sentinel):
+                        sentinel_checked = True
+                
+                # 同一行連續重複過多次視為失控的生成
+                if "\n" in delta and self._is_runaway("".join(chunks)):
+                    stopped = "runaway"
+                    logger.warning(f"偵測到重複生成，提前停止 ({prompt_type})")
+                    break
+        finally:
+            stream.close()
+        
+        stats["stopped"] = stopped
+        if stats["ttft"] is not None:
+            logger.info(
+                f"VLM 串流 ({prompt_type}): TTFT {stats['ttft']:.2f}s，"
+                f"{stats['tokens']} tokens，{stats['tokens_per_sec']:.1f} tokens/s"
+                + (f"，提前停止: {stopped}" if stopped else "")
+            )
+        
+        # 串流中斷（讀取錯誤或沒有收到 [DONE]）且不是主動停止時視為失敗，
+        # 不完整的內容只保留在 stream_stats，避免被當作完成的結果寫入日誌與 PDF
+        if stopped is None and not stats["completed"]:
+            if stats["error"] is None:
+                stats["error"] = "串流未完整結束"
+            stats["partial_content"] = "".join(chunks)
+            if chunks:
+                logger.warning(f"VLM 串流中斷 ({prompt_type})，捨棄 {len(stats['partial_content'])} 字的不完整內容")
+            return {"success": False, "error": stats["error"], "stream_stats": stats}
+        
+        content = stop_sentinel if stopped == "sentinel" else "".join(chunks)
+        return {"success": True, "content": content, "cached": stats["cached"], "stream_stats": stats}
+    
+    def _is_runaway(self, content: str) -> bool:
+        """最後 runaway_repeat 行完全相同（且非空白）時視為失控"""
+        if self.runaway_repeat <= 0:
+            return False
+        lines = content.rstrip("\n").rsplit("\n", self.runaway_repeat)
+        if len(lines) <= self.runaway_repeat:
+            return False
+        tail = lines[-self.runaway_repeat:]
+        return bool(tail[0].strip()) and all(line == tail[0] for line in tail)
+    
+    def get_image_description_and_ocr(self, image_base64: Union[str, ImagePayload], combined: bool = None) -> Dict[str, str]:
+        """
+        獲取圖片描述和 OCR 結果
+        
+        Args:
+            image_base64: base64 編碼的圖片，或已編碼的 ImagePayload
+            combined: 是否以單次請求同時取得描述與文字，預設讀取 VLM_COMBINED_MODE
+        
+        Returns:
+            包含 description 與 ocr_text 的字典
+        """
+        if self._use_combined_mode(combined):
+            # 單次請求同時取得描述與 OCR，圖片只需上傳與編碼一次
+            parsed = self._parse_combined_result(self.analyze_image(image_base64, "combined"))
+            if parsed is not None:
+                return parsed
         
         # 獲取圖片描述
         desc_result = self.analyze_image(image_base64, "description")
-        description = desc_result.get("content", "無法獲取描述") if desc_result["success"] else "描述分析失敗"
         
         # 獲取 OCR 結果
         ocr_result = self.analyze_image(image_base64, "ocr")
-        ocr_text = ocr_result.get("content", "無文字內容") if ocr_result["success"] else "OCR 分析失敗"
         
-        return {
-            "description": description,
-            "ocr_text": ocr_text
-        }
\ No newline at end of file
+        return self._merge_separate_results(desc_result, ocr_result)
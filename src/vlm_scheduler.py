@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+VLM 請求排程模組
+以有界併發方式送出 VLM 請求，讓 vLLM 的連續批次處理保持飽和
+"""
+
+import os
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+class VLMRequestScheduler:
+    """有界併發的 VLM 請求排程器"""
+
+    def __init__(self, max_in_flight: int = None):
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv("VLM_MAX_CONCURRENCY", "8"))
+        self.max_in_flight = max(1, max_in_flight)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_in_flight,
+            thread_name_prefix="vlm-request"
+        )
+        logger.info(f"VLM 請求排程器已啟動，最大併發數: {self.max_in_flight}")
+
+    def imap(self, func: Callable, items: Iterable) -> Iterator:
+        """
+        依輸入順序逐一產出結果，同時保持最多 max_in_flight 個請求在途
+
+        Args:
+            func: 對每個項目執行的函數（通常包含一次或多次 VLM 請求）
+            items: 要處理的項目，可以是任意可迭代物件
+
+        Returns:
+            與輸入順序一致的結果迭代器
+        """
+        pending = deque()
+
+        for item in items:
+            pending.append(self._executor.submit(func, item))
+            # 在途請求達到上限時，先取回最早的結果再繼續送出
+            if len(pending) >= self.max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    def map(self, func: Callable, items: Iterable) -> List:
+        """與 imap 相同，但一次返回完整的結果列表"""
+        return list(self.imap(func, items))
+
+    def shutdown(self):
+        """關閉排程器並等待在途請求完成"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False